@@ -2,6 +2,7 @@
 import base64
 import io
 import os
+import uuid
 
 import requests
 import streamlit as st
@@ -23,6 +24,9 @@ if on_key not in st.session_state:
     st.session_state[on_key] = False
 if seed_key not in st.session_state:
     st.session_state[seed_key] = 0
+# one stream per browser session: lets the API reuse results for repeated frames
+if "stream_id" not in st.session_state:
+    st.session_state["stream_id"] = uuid.uuid4().hex
 
 label = "⏹ Stop camera" if st.session_state[on_key] else "▶ Start camera"
 if st.button(label, type="primary"):
@@ -53,8 +57,16 @@ if st.session_state[on_key]:
         b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
 
         try:
+            # live frame: jump ahead of bulk batches, drop if not served in time
             r = requests.post(
-                f"{API_URL}{endpoint}", json={"instances": [b64]}, timeout=15
+                f"{API_URL}{endpoint}",
+                json={"instances": [b64]},
+                headers={
+                    "X-Priority": "interactive",
+                    "X-Deadline-Ms": "15000",
+                    "X-Stream-Id": st.session_state["stream_id"],
+                },
+                timeout=15,
             )
             r.raise_for_status()
             payload = r.json()
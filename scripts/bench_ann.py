@@ -0,0 +1,85 @@
+# scripts/bench_ann.py
+"""
+Recall / latency benchmark for src/serving/ann.py at scale.
+
+  python scripts/bench_ann.py --n 1000000 --dim 1280 --nprobe 4 8 16 32
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from src.serving.ann import IVFIndex, normalize  # noqa: E402
+
+
+def synthetic(n: int, dim: int, clusters: int, seed: int, chunk: int = 100_000):
+    """Clustered unit vectors (embeddings are far from uniform); same centers for every seed."""
+    centers = normalize(np.random.default_rng(0).standard_normal((clusters, dim)))
+    rng = np.random.default_rng(seed + 1)
+    for s in range(0, n, chunk):
+        m = min(chunk, n - s)
+        noise = rng.standard_normal((m, dim)) * (1.0 / np.sqrt(dim))
+        yield normalize(centers[rng.integers(0, clusters, m)] + noise)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=1_000_000)
+    ap.add_argument("--dim", type=int, default=1280)
+    ap.add_argument("--nlist", type=int, default=1024)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    ap.add_argument("--dir", help="index directory (default: temp dir)")
+    a = ap.parse_args()
+
+    path = Path(a.dir or tempfile.mkdtemp(prefix="ann_bench_"))
+    idx = IVFIndex(path, dim=a.dim, nlist=a.nlist, train_size=a.n + 1)
+    t0 = time.perf_counter()
+    for i, x in enumerate(synthetic(a.n, a.dim, 4 * a.nlist, seed=0)):
+        idx.add(x, [str(i * 100_000 + j) for j in range(len(x))])
+    print(f"add {a.n} x {a.dim}: {time.perf_counter() - t0:.1f}s")
+    t0 = time.perf_counter()
+    idx.train()
+    print(f"train nlist={a.nlist}: {time.perf_counter() - t0:.1f}s")
+
+    q = next(synthetic(a.queries, a.dim, 4 * a.nlist, seed=1))
+    # exact ground truth, chunked over the memmap
+    best = np.full((len(q), a.k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(q), a.k), dtype=np.int64)
+    vec = idx._vec  # pylint: disable=protected-access
+    for s in range(0, a.n, 65536):
+        sc = q @ np.asarray(vec[s : s + 65536], dtype=np.float32).T
+        allsc = np.concatenate([best, sc], axis=1)
+        allid = np.concatenate(
+            [best_ids, np.arange(s, s + sc.shape[1])[None].repeat(len(q), 0)], axis=1
+        )
+        top = np.argpartition(-allsc, a.k - 1, axis=1)[:, : a.k]
+        best = np.take_along_axis(allsc, top, 1)
+        best_ids = np.take_along_axis(allid, top, 1)
+    truth = [{idx.keys[i] for i in row} for row in best_ids]
+
+    for nprobe in a.nprobe:
+        lat, hits = [], 0
+        for qi, t in zip(q, truth):
+            t0 = time.perf_counter()
+            res = idx.search(qi, k=a.k, nprobe=nprobe)[0]
+            lat.append((time.perf_counter() - t0) * 1000)
+            hits += len(t & {key for key, _ in res})
+        lat_a = np.asarray(lat)
+        print(
+            f"nprobe={nprobe:<3} recall@{a.k}={hits / (a.k * len(q)):.3f} "
+            f"p50={np.percentile(lat_a, 50):.2f}ms p99={np.percentile(lat_a, 99):.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# scripts/bench_native.py
+"""
+Parity + latency check of the lean inference path (INFERENCE_BACKEND=native)
+against the ultralytics predictor, on the same weights and images.
+
+  python scripts/bench_native.py --task det --images data/processed/images --n 50
+  python scripts/bench_native.py --task seg --model models/yolov8n-seg.pt
+
+The pass/fail parity check also runs in tests/test_native_parity.py; this
+script is for latency numbers on real data.
+
+Exits non-zero if any image differs: same number of instances, same classes,
+boxes / polygon points within --atol pixels and confidences within --conf-atol.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from src.serving.inference import build_service  # noqa: E402
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
+
+
+def _images(folder: str, n: int) -> List[Image.Image]:
+    files = sorted(f for f in Path(folder).rglob("*") if f.suffix.lower() in IMG_EXTS)
+    if not files:
+        raise SystemExit(f"no images under {folder}")
+    return [Image.open(f).convert("RGB") for f in files[:n]]
+
+
+def _diff(
+    task: str, a: Dict[str, Any], b: Dict[str, Any], atol: float, conf_atol: float
+) -> str:
+    key = "bboxes" if task == "det" else "masks"
+    xs, ys = a[key], b[key]
+    if len(xs) != len(ys):
+        return f"{len(xs)} vs {len(ys)} instances"
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        if x["cls"] != y["cls"]:
+            return f"#{i} cls {x['cls']} vs {y['cls']}"
+        if abs(x["conf"] - y["conf"]) > conf_atol:
+            return f"#{i} conf {x['conf']:.4f} vs {y['conf']:.4f}"
+        if task == "det":
+            p = np.array([x[k] for k in ("x1", "y1", "x2", "y2")])
+            q = np.array([y[k] for k in ("x1", "y1", "x2", "y2")])
+        else:
+            p, q = np.array(x["points"]), np.array(y["points"])
+            if p.shape != q.shape:
+                return f"#{i} polygon {len(p)} vs {len(q)} points"
+        if p.size and np.abs(p - q).max() > atol:
+            return f"#{i} coords differ by {np.abs(p - q).max():.3f}px"
+    return ""
+
+
+def _latency(svc, imgs: List[Image.Image], warmup: int) -> np.ndarray:
+    for im in imgs[:warmup]:
+        svc.predict(im)
+    lat = []
+    for im in imgs:
+        t0 = time.perf_counter()
+        svc.predict(im)
+        lat.append((time.perf_counter() - t0) * 1000)
+    return np.asarray(lat)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--task", choices=["det", "seg"], default="det")
+    ap.add_argument("--model", help="weights (default: the service's default)")
+    ap.add_argument("--images", default="data/processed/images")
+    ap.add_argument("--n", type=int, default=50)
+    ap.add_argument("--imgsz", type=int)
+    ap.add_argument("--warmup", type=int, default=3)
+    ap.add_argument("--atol", type=float, default=1.0)
+    ap.add_argument("--conf-atol", type=float, default=1e-3)
+    a = ap.parse_args()
+
+    kwargs: Dict[str, Any] = {"imgsz": a.imgsz}
+    if a.model:
+        kwargs["model_path"] = a.model
+    ref = build_service(a.task, native=False, **kwargs)
+    lean = build_service(a.task, native=True, **kwargs)
+    imgs = _images(a.images, a.n)
+
+    bad = 0
+    for i, im in enumerate(imgs):
+        d = _diff(a.task, ref.predict(im), lean.predict(im), a.atol, a.conf_atol)
+        if d:
+            bad += 1
+            print(f"[parity] image {i}: {d}")
+    print(f"[parity] {len(imgs) - bad}/{len(imgs)} images match")
+
+    for name, svc in (("ultralytics", ref), ("native", lean)):
+        lat = _latency(svc, imgs, a.warmup)
+        print(
+            f"[latency] {name:<11} p50={np.percentile(lat, 50):.2f}ms "
+            f"p99={np.percentile(lat, 99):.2f}ms mean={lat.mean():.2f}ms"
+        )
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,19 @@
 # scripts/bootstrap_models.py
 from __future__ import annotations
 
-import hashlib
 import os
-from pathlib import Path
-from typing import Optional
 import sys
-
-try:
-    import requests
-except ImportError:
-    print("requests not installed. Run: pip install requests", file=sys.stderr)
-    sys.exit(1)
+from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[1]
-MODELS_DIR = ROOT / "models"
+sys.path.insert(0, str(ROOT))
+
+from src.artifacts.store import ArtifactStore  # noqa: E402
+
+MODELS_DIR = Path(os.getenv("MODELS_DIR", ROOT / "models"))
 MODELS_DIR.mkdir(parents=True, exist_ok=True)
 
+# sha256 None -> pinned in the store manifest on first download and verified after that
 WEIGHTS = {
     # detection
     "yolov8n.pt": {
@@ -35,36 +32,16 @@ WEIGHTS = {
     },
 }
 
-def _sha256(path: Path) -> str:
-    h = hashlib.sha256()
-    with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-def download_one(name: str, url: str, sha256: Optional[str]) -> None:
-    out = MODELS_DIR / name
-    if out.exists() and (sha256 is None or _sha256(out) == sha256):
-        print(f"[skip] {name} already present.")
-        return
-
-    print(f"[downloading] {name} → {out}")
-    with requests.get(url, stream=True, timeout=60) as r:
-        r.raise_for_status()
-        with out.open("wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 1024):
-                if chunk:
-                    f.write(chunk)
-
-    if sha256:
-        got = _sha256(out)
-        if got != sha256:
-            out.unlink(missing_ok=True)
-            raise RuntimeError(f"SHA256 mismatch for {name}: got {got}, want {sha256}")
 
 def main() -> None:
-    for fname, meta in WEIGHTS.items():
-        download_one(fname, meta["url"], meta.get("sha256"))
+    store = ArtifactStore.default(MODELS_DIR)
+    specs = [
+        {"name": name, "url": meta["url"], "sha256": meta.get("sha256"), "link_to": MODELS_DIR / name}
+        for name, meta in WEIGHTS.items()
+    ]
+    for name, obj in store.fetch_many(specs, workers=len(specs)).items():
+        print(f"[ok] {name} -> {obj.name[:12]}")
+
 
 if __name__ == "__main__":
     main()
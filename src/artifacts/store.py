@@ -0,0 +1,287 @@
+"""
+Content-addressed artifact store for model weights.
+
+Layout (default models/.store, override with ARTIFACT_STORE):
+  objects/<sha[:2]>/<sha256>   immutable blobs
+  manifest.json                {"artifacts": {name: {"sha256", "size", "source", "updated"}}}
+  tmp/                         in-flight downloads (<name>.partial), resumed with HTTP Range
+
+Every write goes temp-file -> fsync -> os.replace, so a crash never leaves a
+truncated object or manifest behind. `fetch()` checks, in order: the store
+itself, a local mirror directory (ARTIFACT_MIRROR, files named <name> or
+<sha256>), then the URL. Named files (models/<name>) are hard links to the
+object (copy as fallback), so existing *_MODEL_PATH settings keep working.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import http.client
+import json
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+CHUNK = 1024 * 1024
+
+
+class IntegrityError(RuntimeError):
+    pass
+
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open("wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class ArtifactStore:
+    def __init__(
+        self,
+        root: str | Path,
+        mirror: Optional[str | Path] = None,
+        timeout: float = 60.0,
+        retries: int = 3,
+    ):
+        self.root = Path(root).resolve()
+        self.mirror = Path(mirror).resolve() if mirror else None
+        self.timeout = timeout
+        self.retries = retries
+        self.objects = self.root / "objects"
+        self.tmp = self.root / "tmp"
+        self.manifest_path = self.root / "manifest.json"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.tmp.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls, models_dir: str | Path = "models") -> "ArtifactStore":
+        return cls(
+            os.getenv("ARTIFACT_STORE") or Path(models_dir) / ".store",
+            mirror=os.getenv("ARTIFACT_MIRROR") or None,
+        )
+
+    # ------------------------------------------------------------ manifest
+
+    def manifest(self) -> Dict[str, Dict[str, Any]]:
+        if not self.manifest_path.exists():
+            return {}
+        return json.loads(self.manifest_path.read_text()).get("artifacts", {})
+
+    def _record(self, name: str, sha: str, size: int, source: str) -> None:
+        with self._lock:
+            arts = self.manifest()
+            arts[name] = {"sha256": sha, "size": size, "source": source, "updated": time.time()}
+            _atomic_write(
+                self.manifest_path,
+                json.dumps({"artifacts": arts}, indent=2, sort_keys=True).encode(),
+            )
+
+    def object_path(self, sha: str) -> Path:
+        return self.objects / sha[:2] / sha
+
+    def path(self, name: str) -> Optional[Path]:
+        meta = self.manifest().get(name)
+        if not meta:
+            return None
+        p = self.object_path(meta["sha256"])
+        return p if p.exists() else None
+
+    # ------------------------------------------------------------ ingest
+
+    def _ingest(self, tmp: Path, name: str, source: str, expect: Optional[str]) -> Path:
+        """Verify a fully written temp file and move it into objects/ atomically."""
+        sha = sha256_file(tmp)
+        if expect and sha != expect:
+            tmp.unlink(missing_ok=True)
+            raise IntegrityError(f"sha256 mismatch for {name}: got {sha}, want {expect}")
+        dst = self.object_path(sha)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        size = tmp.stat().st_size
+        if dst.exists():
+            tmp.unlink()
+        else:
+            os.replace(tmp, dst)
+        self._record(name, sha, size, source)
+        return dst
+
+    def put(self, src: str | Path, name: Optional[str] = None) -> str:
+        """Publish a local file under `name`; returns its sha256."""
+        src = Path(src)
+        name = name or src.name
+        tmp = self.tmp / f"{name}.{os.getpid()}.put"
+        with src.open("rb") as fi, tmp.open("wb") as fo:
+            shutil.copyfileobj(fi, fo, CHUNK)
+            fo.flush()
+            os.fsync(fo.fileno())
+        return self._ingest(tmp, name, f"file://{src.resolve()}", None).name
+
+    # ------------------------------------------------------------ fetch
+
+    def _from_mirror(self, name: str, expect: Optional[str]) -> Optional[Path]:
+        if self.mirror is None:
+            return None
+        for cand in ([self.mirror / expect] if expect else []) + [self.mirror / name]:
+            if cand.is_file():
+                tmp = self.tmp / f"{name}.{os.getpid()}.mirror"
+                shutil.copyfile(cand, tmp)
+                try:
+                    return self._ingest(tmp, name, f"file://{cand}", expect)
+                except IntegrityError:
+                    continue
+        return None
+
+    @staticmethod
+    def _total(r: Any, have: int) -> Tuple[str, Optional[int]]:
+        """(file mode, expected final size) for a response to a (possibly ranged) GET."""
+        if r.status == 206:
+            # Content-Range: bytes <start>-<end>/<total>
+            rng = r.headers.get("Content-Range", "")
+            try:
+                span, total = rng.split(" ", 1)[1].split("/")
+                start = int(span.split("-")[0])
+            except (IndexError, ValueError):
+                start, total = -1, "*"
+            if start == have:
+                return "ab", None if total == "*" else int(total)
+        # full body (server ignored the range, or a range we cannot trust): restart
+        length = r.headers.get("Content-Length")
+        return "wb", int(length) if length and length.isdigit() else None
+
+    def _download(self, name: str, url: str, expect: Optional[str]) -> Path:
+        """
+        Resumable GET into tmp/<name>.partial. A body shorter than the advertised
+        Content-Length / Content-Range total keeps the partial and resumes with
+        Range; `retries` bounds consecutive attempts that make no progress.
+        """
+        part = self.tmp / f"{name}.partial"
+        last: Optional[Exception] = None
+        failures = 0
+        while failures < self.retries:
+            have = part.stat().st_size if part.exists() else 0
+            req = urllib.request.Request(url)
+            if have:
+                req.add_header("Range", f"bytes={have}-")
+            total: Optional[int] = None
+            try:
+                with urllib.request.urlopen(req, timeout=self.timeout) as r:
+                    mode, total = self._total(r, have)
+                    with part.open(mode) as f:
+                        try:
+                            for chunk in iter(lambda: r.read(CHUNK), b""):
+                                f.write(chunk)
+                        finally:  # keep whatever arrived for the next Range request
+                            f.flush()
+                            os.fsync(f.fileno())
+            except urllib.error.HTTPError as e:
+                # 416 is only "already complete" if the server's size matches ours
+                rng = e.headers.get("Content-Range", "") if e.headers else ""
+                size = rng.rpartition("/")[2]
+                if e.code == 416 and have and size.isdigit() and int(size) == have:
+                    total = have
+                else:
+                    if e.code == 416:
+                        part.unlink(missing_ok=True)
+                    last = e
+                    failures += 1
+                    time.sleep(min(2**failures, 10))
+                    continue
+            except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+                # includes IncompleteRead / connection resets mid-body
+                last = e
+                got = part.stat().st_size if part.exists() else 0
+                failures = 0 if got > have else failures + 1
+                time.sleep(min(2**failures, 10))
+                continue
+            got = part.stat().st_size if part.exists() else 0
+            if total is not None and got != total:
+                last = IOError(f"short read: {got} of {total} bytes")
+                if got > total:
+                    part.unlink(missing_ok=True)
+                failures = 0 if have < got < total else failures + 1
+                time.sleep(min(2**failures, 10) if failures else 0)
+                continue
+            try:
+                return self._ingest(part, name, url, expect)
+            except IntegrityError as e:
+                last = e  # corrupt partial was deleted; retry from scratch
+                failures += 1
+        raise RuntimeError(f"failed to fetch {name} from {url}: {last}")
+
+    def fetch(
+        self,
+        name: str,
+        url: Optional[str] = None,
+        sha256: Optional[str] = None,
+        link_to: Optional[str | Path] = None,
+    ) -> Path:
+        """
+        Ensure `name` is in the store and return its object path. Without an
+        explicit sha256 the manifest entry from the first successful fetch is
+        used to verify later ones (trust on first use).
+        """
+        meta = self.manifest().get(name)
+        expect = sha256 or (meta or {}).get("sha256")
+        obj = self.object_path(expect) if expect else None
+        if obj is None or not obj.exists():
+            obj = self._from_mirror(name, expect)
+            if obj is None:
+                if not url:
+                    raise FileNotFoundError(f"{name} not in store or mirror and no url given")
+                obj = self._download(name, url, expect)
+        elif meta is None or meta["sha256"] != expect:
+            self._record(name, expect, obj.stat().st_size, url or "")
+        if link_to is not None:
+            self.materialize(obj, Path(link_to))
+        return obj
+
+    def fetch_many(
+        self, specs: Iterable[Dict[str, Any]], workers: int = 4
+    ) -> Dict[str, Path]:
+        """Concurrent fetch; each spec is {name, url, sha256?, link_to?}."""
+        specs = list(specs)
+        with ThreadPoolExecutor(max(1, min(workers, len(specs)))) as ex:
+            futs = {
+                s["name"]: ex.submit(
+                    self.fetch, s["name"], s.get("url"), s.get("sha256"), s.get("link_to")
+                )
+                for s in specs
+            }
+            return {n: f.result() for n, f in futs.items()}
+
+    @staticmethod
+    def materialize(obj: Path, dst: Path) -> None:
+        """Expose an object at a human path (hard link, copy across devices)."""
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if dst.exists() and os.path.samefile(obj, dst):
+            return
+        tmp = dst.with_name(f".{dst.name}.{os.getpid()}.link")
+        tmp.unlink(missing_ok=True)
+        try:
+            os.link(obj, tmp)
+        except OSError:
+            shutil.copyfile(obj, tmp)
+        os.replace(tmp, dst)
+
+    def verify(self) -> Dict[str, bool]:
+        return {
+            name: (p := self.object_path(m["sha256"])).exists() and sha256_file(p) == m["sha256"]
+            for name, m in self.manifest().items()
+        }
@@ -0,0 +1,317 @@
+"""
+Persistent approximate nearest-neighbour index over image embeddings (IVF-Flat, NumPy).
+
+Vectors are L2-normalised and scored by inner product (cosine). Layout of an
+index directory:
+
+  meta.json     {"dim", "nlist", "n", "capacity", "trained"}
+  vectors.f16   float16 memmap (capacity, dim)
+  assign.i32    int32 memmap (capacity,) -> coarse list of each vector (-1 = untrained)
+  centroids.npy float32 (nlist, dim), k-means on a sample once n >= train_size
+  keys.jsonl    one JSON-encoded external key per line, row-aligned with vectors
+                (keys may contain newlines; a legacy keys.txt is converted on open)
+
+Search probes the `nprobe` closest lists and scores only their members straight
+from the memmap; before the quantizer is trained it falls back to exact search.
+Once `train_size` vectors are in, `add` starts training on a background thread
+and returns; k-means and the bulk assignment run without the index lock, so
+adds and (exact) searches keep being served until the trained lists swap in.
+Inverted lists are kept as a CSR array (rebuilt on open) plus small per-list
+pending buffers for recent adds, so adding a vector never re-sorts the index.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_MERGE_PENDING = 50_000  # fold pending adds into the CSR lists past this many
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (inner-product assignment) on normalised rows."""
+    rng = np.random.default_rng(seed)
+    c = x[rng.choice(len(x), size=k, replace=len(x) < k)].copy()
+    for _ in range(iters):
+        a = np.argmax(x @ c.T, axis=1)
+        sums = np.zeros_like(c)
+        np.add.at(sums, a, x)
+        counts = np.bincount(a, minlength=k)
+        empty = counts == 0
+        sums[empty] = x[rng.choice(len(x), size=int(empty.sum()))]
+        c = normalize(sums)
+    return c
+
+
+class IVFIndex:
+    def __init__(
+        self,
+        path: str | Path,
+        dim: Optional[int] = None,
+        nlist: int = 1024,
+        train_size: Optional[int] = None,
+    ):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._trainer: Optional[threading.Thread] = None
+        meta_f = self.path / "meta.json"
+        if meta_f.exists():
+            self.meta = json.loads(meta_f.read_text())
+        else:
+            if dim is None:
+                raise ValueError("dim is required to create a new index")
+            self.meta = {
+                "dim": int(dim),
+                "nlist": int(nlist),
+                "n": 0,
+                "capacity": 0,
+                "trained": False,
+            }
+        self.dim = int(self.meta["dim"])
+        self.nlist = int(self.meta["nlist"])
+        self.train_size = int(train_size or self.nlist * 32)
+        self.keys: List[str] = self._load_keys()
+        self.centroids: Optional[np.ndarray] = None
+        if self.meta["trained"]:
+            self.centroids = np.load(self.path / "centroids.npy")
+        self._vec: Optional[np.memmap] = None
+        self._asg: Optional[np.memmap] = None
+        self._open(int(self.meta["capacity"]))
+        self._rebuild_lists()
+
+    # ------------------------------------------------------------ storage
+
+    def _open(self, capacity: int) -> None:
+        self.meta["capacity"] = capacity
+        if capacity == 0:
+            self._vec = self._asg = None
+            return
+        for name, dtype, shape in (
+            ("vectors.f16", np.float16, (capacity, self.dim)),
+            ("assign.i32", np.int32, (capacity,)),
+        ):
+            f = self.path / name
+            need = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            with open(f, "ab") as fh:
+                if fh.tell() < need:
+                    fh.truncate(need)
+        self._vec = np.memmap(
+            self.path / "vectors.f16",
+            dtype=np.float16,
+            mode="r+",
+            shape=(capacity, self.dim),
+        )
+        self._asg = np.memmap(
+            self.path / "assign.i32", dtype=np.int32, mode="r+", shape=(capacity,)
+        )
+
+    def _load_keys(self) -> List[str]:
+        n = int(self.meta["n"])
+        f = self.path / "keys.jsonl"
+        if f.exists():
+            return [json.loads(line) for line in f.read_text().split("\n")[:n] if line]
+        legacy = self.path / "keys.txt"
+        if not legacy.exists():
+            return []
+        keys = legacy.read_text().split("\n")[:n]
+        tmp = f.with_suffix(".tmp")
+        tmp.write_text("".join(json.dumps(k) + "\n" for k in keys))
+        os.replace(tmp, f)
+        return keys
+
+    def _grow(self, need: int) -> None:
+        cap = int(self.meta["capacity"])
+        if need <= cap:
+            return
+        new = max(need, cap * 2, 1024)
+        if self._vec is not None:
+            self._vec.flush()
+            self._asg.flush()
+        self._vec = self._asg = None
+        self._open(new)
+        self._asg[cap:] = -1
+
+    def save(self) -> None:
+        with self._lock:
+            if self._vec is not None:
+                self._vec.flush()
+                self._asg.flush()
+            tmp = self.path / "meta.json.tmp"
+            tmp.write_text(json.dumps(self.meta))
+            os.replace(tmp, self.path / "meta.json")
+
+    def __len__(self) -> int:
+        return int(self.meta["n"])
+
+    # ------------------------------------------------------------ lists
+
+    def _rebuild_lists(self) -> None:
+        n = len(self)
+        self._pending: Dict[int, List[int]] = {}
+        self._npending = 0
+        if not self.meta["trained"] or n == 0:
+            self._order = np.zeros(0, dtype=np.int64)
+            self._offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+            return
+        a = np.asarray(self._asg[:n])
+        self._order = np.argsort(a, kind="stable")
+        self._offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(a, minlength=self.nlist)))
+        )
+
+    def _members(self, lists: Sequence[int]) -> np.ndarray:
+        parts = [self._order[self._offsets[l] : self._offsets[l + 1]] for l in lists]
+        parts += [np.asarray(self._pending[l]) for l in lists if l in self._pending]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def _assign(vec: np.ndarray, c: np.ndarray, start: int, stop: int) -> np.ndarray:
+        return np.concatenate(
+            [
+                np.argmax(
+                    np.asarray(vec[s : min(stop, s + 65536)], dtype=np.float32) @ c.T,
+                    axis=1,
+                )
+                for s in range(start, stop, 65536)
+            ]
+            or [np.zeros(0, dtype=np.int64)]
+        )
+
+    def train(self, sample: int = 65536, iters: int = 10) -> None:
+        """
+        Fit the coarse quantizer on the first n vectors. Only the snapshot and
+        the final swap hold the lock; vectors added meanwhile are assigned at
+        the swap.
+        """
+        with self._lock:
+            n = len(self)
+            if n < self.nlist:
+                raise ValueError(
+                    f"need at least nlist={self.nlist} vectors to train, have {n}"
+                )
+            vec = self._vec  # rows < n are never rewritten; _grow keeps them
+        rng = np.random.default_rng(0)
+        idx = np.sort(rng.choice(n, size=min(n, sample), replace=False))
+        c = kmeans(np.asarray(vec[idx], dtype=np.float32), self.nlist, iters)
+        a = self._assign(vec, c, 0, n)
+        with self._lock:
+            m = len(self)
+            self._asg[:n] = a
+            self._asg[n:m] = self._assign(self._vec, c, n, m)
+            np.save(self.path / "centroids.npy", c)
+            self.centroids = c
+            self.meta["trained"] = True
+            self._rebuild_lists()
+            self.save()
+
+    def _train_background(self) -> None:
+        try:
+            self.train()
+        except Exception as e:  # keep serving exact search; retried on a later add
+            print(f"[ann] background training failed: {e}")
+        finally:
+            with self._lock:
+                self._trainer = None
+
+    @property
+    def training(self) -> bool:
+        return self._trainer is not None
+
+    # ------------------------------------------------------------ api
+
+    def add(self, vectors: np.ndarray, keys: Sequence[str]) -> List[int]:
+        x = normalize(np.atleast_2d(vectors))
+        if x.shape[1] != self.dim:
+            raise ValueError(f"expected dim {self.dim}, got {x.shape[1]}")
+        if len(keys) != len(x):
+            raise ValueError("one key per vector")
+        with self._lock:
+            n0 = len(self)
+            self._grow(n0 + len(x))
+            self._vec[n0 : n0 + len(x)] = x.astype(np.float16)
+            if self.meta["trained"]:
+                a = np.argmax(x @ self.centroids.T, axis=1)
+                self._asg[n0 : n0 + len(x)] = a
+                for i, l in enumerate(a.tolist()):
+                    self._pending.setdefault(l, []).append(n0 + i)
+                self._npending += len(x)
+            else:
+                self._asg[n0 : n0 + len(x)] = -1
+            self.meta["n"] = n0 + len(x)
+            self.keys.extend(keys)
+            with open(self.path / "keys.jsonl", "a") as f:
+                f.writelines(json.dumps(k) + "\n" for k in keys)
+            if self.meta["trained"] and self._npending >= _MERGE_PENDING:
+                self._rebuild_lists()
+            self.save()
+            if (
+                not self.meta["trained"]
+                and self._trainer is None
+                and len(self) >= self.train_size
+            ):
+                self._trainer = threading.Thread(
+                    target=self._train_background, name="ann-train", daemon=True
+                )
+                self._trainer.start()
+            return list(range(n0, n0 + len(x)))
+
+    def search(
+        self, queries: np.ndarray, k: int = 10, nprobe: int = 16
+    ) -> List[List[Tuple[str, float]]]:
+        q = normalize(np.atleast_2d(queries))
+        out: List[List[Tuple[str, float]]] = []
+        with self._lock:
+            n = len(self)
+            if n == 0:
+                return [[] for _ in q]
+            for qi in q:
+                if self.meta["trained"]:
+                    lists = np.argpartition(
+                        -(self.centroids @ qi), min(nprobe, self.nlist) - 1
+                    )[:nprobe]
+                    ids = np.sort(self._members(lists.tolist()))
+                    scores = (
+                        np.asarray(self._vec[ids], dtype=np.float32) @ qi
+                        if len(ids)
+                        else np.zeros(0)
+                    )
+                else:
+                    ids = np.arange(n)
+                    scores = np.concatenate(
+                        [
+                            np.asarray(
+                                self._vec[s : min(n, s + 65536)], dtype=np.float32
+                            )
+                            @ qi
+                            for s in range(0, n, 65536)
+                        ]
+                    )
+                kk = min(k, len(ids))
+                if kk == 0:
+                    out.append([])
+                    continue
+                top = np.argpartition(-scores, kk - 1)[:kk]
+                top = top[np.argsort(-scores[top])]
+                out.append([(self.keys[int(ids[t])], float(scores[t])) for t in top])
+        return out
+
+
+@lru_cache(maxsize=1)
+def get_ann(dim: int) -> IVFIndex:
+    return IVFIndex(
+        os.getenv("EMBED_INDEX_DIR", "data/embed_index"),
+        dim=dim,
+        nlist=int(os.getenv("EMBED_INDEX_NLIST", "1024")),
+    )
@@ -1,14 +1,23 @@
 from __future__ import annotations
 
 import base64
+import hmac
 import io
-from typing import Any, Dict, List
+import os
+import uuid
+from typing import Any, Callable, Dict, List, Optional
 
-from fastapi import Body, FastAPI, File, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import Body, FastAPI, File, Header, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
 from PIL import Image
 
-from .inference import get_cls, get_det, get_seg
+from .ann import get_ann
+from .inference import get_cls
+from .pipeline import get_pipeline
+from .prediction_store import get_store
+from .profiling import PROFILER, ProfileSession
+from .scheduler import DeadlineExceeded, get_scheduler, parse_deadline
+from .shadow import get_shadow
 from .schemas import Health
 
 app = FastAPI(title="CV API", version="1.0", docs_url="/docs")
@@ -22,6 +31,59 @@ def _b64_to_image(s: str) -> Image.Image:
     return Image.open(io.BytesIO(base64.b64decode(s))).convert("RGB")
 
 
+def _stream_id(request: Request) -> Optional[str]:
+    # no fallback to the client address: behind a proxy every caller shares it,
+    # and near-duplicate reuse across callers would leak predictions
+    return request.headers.get("x-stream-id") or None
+
+
+def _run(
+    task: str,
+    blobs: List[Any],
+    request: Request,
+    default_cls: str,
+    priority: Optional[str],
+    deadline_ms: Optional[str],
+) -> List[bytes]:
+    """JSON prediction per image via the staged pipeline; 504 if any misses its deadline."""
+    cls, deadline = parse_deadline(default_cls, priority, deadline_ms)
+    try:
+        return get_pipeline().run(task, blobs, _stream_id(request), cls, deadline)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e)) from e
+
+
+def _json(body: bytes) -> Response:
+    return Response(body, media_type="application/json")
+
+
+def _batch(preds: List[bytes]) -> Response:
+    return _json(b'{"predictions":[' + b",".join(preds) + b"]}")
+
+
+def _instances(payload: Dict[str, Any]) -> List[Any]:
+    return [
+        it.get("b64") if isinstance(it, dict) else it
+        for it in payload.get("instances") or []
+    ]
+
+
+def _schedule(
+    fn: Callable[[], Any],
+    default_cls: str,
+    priority: Optional[str],
+    deadline_ms: Optional[str],
+) -> Any:
+    """Run one model call (e.g. a whole batch) on the scheduler's model thread."""
+    cls, deadline = parse_deadline(default_cls, priority, deadline_ms)
+    try:
+        return get_scheduler().run(lambda: PROFILER.call(fn), cls, deadline)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e)) from e
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e)) from e
+
+
 @app.get("/health")
 def health():
     # You can enrich this with which models are loaded by calling the getters
@@ -32,58 +94,232 @@ def health():
     ).model_dump()
 
 
+@app.get("/scheduler")
+def scheduler_stats():
+    # served / shed (deadline passed while queued) / late / queued, per priority class
+    return get_scheduler().stats()
+
+
+@app.get("/pipeline")
+def pipeline_stats():
+    # per stage: items / busy_s / mean_ms / queued / utilization since start,
+    # plus where each task's preprocessing runs (decode pool or model thread)
+    return get_pipeline().stats()
+
+
+@app.get("/shadow")
+def shadow_report():
+    # latency + agreement of the candidate model(s) on mirrored traffic
+    shadow = get_shadow()
+    if shadow is None:
+        raise HTTPException(status_code=404, detail="no SHADOW_*_MODEL configured")
+    return shadow.stats()
+
+
+@app.post("/debug/profile", tags=["admin"])
+def debug_profile(
+    requests: int = 10,
+    seconds: float = 30.0,
+    interval_ms: float = 5.0,
+    torch_profile: bool = True,
+    memory: bool = True,
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Profile the next `requests` inference calls (or `seconds`, whichever ends first)."""
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:  # disabled unless an admin token is configured
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, token):
+        raise HTTPException(status_code=403, detail="admin token required")
+    session = ProfileSession(
+        max_calls=requests,
+        seconds=min(seconds, 300.0),
+        interval_ms=interval_ms,
+        torch_profile=torch_profile,
+        memory=memory,
+    )
+    try:
+        blob = PROFILER.profile(session)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    return Response(
+        blob,
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="profile.zip"'},
+    )
+
+
+@app.get("/predictions", tags=["history"])
+def predictions_query(
+    source: Optional[str] = None,
+    task: Optional[str] = None,
+    cls: Optional[str] = None,
+    absent_cls: Optional[str] = None,
+    min_conf: float = 0.0,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 100,
+    payload: bool = False,
+):
+    """Stored frames matching the filters (e.g. cls=person&absent_cls=helmet), newest first."""
+    store = get_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="PREDICTION_STORE is not configured")
+    return store.query(
+        source=source,
+        task=task,
+        cls=cls,
+        absent_cls=absent_cls,
+        min_conf=min_conf,
+        since=since,
+        until=until,
+        limit=min(limit, 10_000),
+        payload=payload,
+    )
+
+
 # detection
 @app.post("/predict", tags=["detection"])
-def detect(file: UploadFile = File(...)):
-    img = _file_to_image(file)
-    pred = get_det().predict(img)
-    return JSONResponse(pred)
+def detect(
+    request: Request,
+    file: UploadFile = File(...),
+    x_priority: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    pred = _run(
+        "det", [file.file.read()], request, "interactive", x_priority, x_deadline_ms
+    )[0]
+    return _json(pred)
 
 
 @app.post("/v1/models:predict", tags=["detection"])
-def detect_vertex(payload: Dict[str, Any] = Body(...)):
-    inst = payload.get("instances") or []
-    preds: List[Dict[str, Any]] = []
-    for it in inst:
-        b64 = it.get("b64") if isinstance(it, dict) else it
-        img = _b64_to_image(b64)
-        preds.append(get_det().predict(img))
-    return JSONResponse({"predictions": preds})
+def detect_vertex(
+    request: Request,
+    payload: Dict[str, Any] = Body(...),
+    x_priority: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    preds = _run(
+        "det", _instances(payload), request, "batch", x_priority, x_deadline_ms
+    )
+    return _batch(preds)
 
 
 # segmentation
 @app.post("/segment", tags=["segmentation"])
-def segment(file: UploadFile = File(...)):
-    img = _file_to_image(file)
-    pred = get_seg().predict(img)
-    return JSONResponse(pred)
+def segment(
+    request: Request,
+    file: UploadFile = File(...),
+    x_priority: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    pred = _run(
+        "seg", [file.file.read()], request, "interactive", x_priority, x_deadline_ms
+    )[0]
+    return _json(pred)
 
 
 @app.post("/v1/segment:predict", tags=["segmentation"])
-def segment_vertex(payload: Dict[str, Any] = Body(...)):
-    inst = payload.get("instances") or []
-    preds: List[Dict[str, Any]] = []
-    for it in inst:
-        b64 = it.get("b64") if isinstance(it, dict) else it
-        img = _b64_to_image(b64)
-        preds.append(get_seg().predict(img))
-    return JSONResponse({"predictions": preds})
+def segment_vertex(
+    request: Request,
+    payload: Dict[str, Any] = Body(...),
+    x_priority: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    preds = _run(
+        "seg", _instances(payload), request, "batch", x_priority, x_deadline_ms
+    )
+    return _batch(preds)
 
 
 # classification
 @app.post("/classify", tags=["classification"])
-def classify(file: UploadFile = File(...)):
-    img = _file_to_image(file)
-    pred = get_cls().predict(img)
-    return JSONResponse(pred)
+def classify(
+    request: Request,
+    file: UploadFile = File(...),
+    x_priority: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    pred = _run(
+        "cls", [file.file.read()], request, "interactive", x_priority, x_deadline_ms
+    )[0]
+    return _json(pred)
 
 
 @app.post("/v1/classify:predict", tags=["classification"])
-def classify_vertex(payload: Dict[str, Any] = Body(...)):
-    inst = payload.get("instances") or []
-    preds: List[Dict[str, Any]] = []
-    for it in inst:
-        b64 = it.get("b64") if isinstance(it, dict) else it
-        img = _b64_to_image(b64)
-        preds.append(get_cls().predict(img))
+def classify_vertex(
+    request: Request,
+    payload: Dict[str, Any] = Body(...),
+    x_priority: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    preds = _run(
+        "cls", _instances(payload), request, "batch", x_priority, x_deadline_ms
+    )
+    return _batch(preds)
+
+
+# embeddings / similarity search
+@app.post("/embed", tags=["embedding"])
+def embed(
+    file: UploadFile = File(...),
+    add: bool = False,
+    key: Optional[str] = None,
+    x_priority: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    img = _file_to_image(file)
+    vec = _schedule(
+        lambda: get_cls().embed([img]), "interactive", x_priority, x_deadline_ms
+    )[0]
+    out: Dict[str, Any] = {
+        "embedding": vec.tolist(),
+        "dim": int(vec.shape[0]),
+        "model_version": get_cls().model_version,
+    }
+    if add:
+        out["key"] = key or file.filename or uuid.uuid4().hex
+        get_ann(vec.shape[0]).add(vec[None], [out["key"]])
+    return JSONResponse(out)
+
+
+@app.post("/v1/embed:predict", tags=["embedding"])
+def embed_vertex(
+    payload: Dict[str, Any] = Body(...),
+    x_priority: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    """{"instances": [b64, ...], "add": false, "keys": [...]} -> one batched forward pass."""
+    imgs = [_b64_to_image(b) for b in _instances(payload)]
+    if not imgs:
+        return JSONResponse({"predictions": []})
+    vecs = _schedule(
+        lambda: get_cls().embed(imgs), "batch", x_priority, x_deadline_ms
+    )
+    preds: List[Dict[str, Any]] = [{"embedding": v.tolist()} for v in vecs]
+    if payload.get("add"):
+        keys = payload.get("keys") or [uuid.uuid4().hex for _ in imgs]
+        if len(keys) != len(imgs):
+            raise HTTPException(status_code=422, detail="one key per instance")
+        get_ann(vecs.shape[1]).add(vecs, [str(k) for k in keys])
+        for p, k in zip(preds, keys):
+            p["key"] = str(k)
     return JSONResponse({"predictions": preds})
+
+
+@app.post("/search", tags=["embedding"])
+def search(
+    file: UploadFile = File(...),
+    k: int = 10,
+    nprobe: int = 16,
+    x_priority: Optional[str] = Header(None),
+    x_deadline_ms: Optional[str] = Header(None),
+):
+    img = _file_to_image(file)
+    vec = _schedule(
+        lambda: get_cls().embed([img]), "interactive", x_priority, x_deadline_ms
+    )[0]
+    hits = get_ann(vec.shape[0]).search(vec, k=k, nprobe=nprobe)[0]
+    return JSONResponse(
+        {"neighbors": [{"key": key, "score": score} for key, score in hits]}
+    )
@@ -1,18 +1,54 @@
+import itertools
 import os
+import threading
+import time
+from collections import OrderedDict
 from functools import lru_cache
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 from pathlib import Path
 
+import numpy as np
 from PIL import Image
 
 MODELS_DIR = Path(os.getenv("MODELS_DIR", "/models")).resolve()
 
+
+def _with_variant(mp: str, task: str) -> str:
+    """
+    Swap in a published variant of the weights (e.g. DET_MODEL_VARIANT=int8 ->
+    yolov8n.int8.onnx next to yolov8n.pt, or in MODELS_DIR). Falls back to `mp`.
+    """
+    variant = os.getenv(f"{task.upper()}_MODEL_VARIANT") or os.getenv("MODEL_VARIANT")
+    if not variant or variant == "fp32":
+        return mp
+    name = f"{Path(mp).stem}.{variant}.onnx"
+    for cand in (Path(mp).with_name(name), MODELS_DIR / name):
+        if cand.exists():
+            return str(cand)
+    print(f"[inference] {task} variant {variant!r} not found ({name}); using {mp}")
+    return mp
+
+
 class BaseService:
     model_version: str = "unknown"
 
     def predict(self, img: Image.Image) -> Dict[str, Any]:
         raise NotImplementedError
 
+    # split used by the serving pipeline: `prepare` runs on the decode pool,
+    # `infer` on the model thread; predict(img) == infer(prepare(img)).
+    # The default is a pass-through: ultralytics' predictor letterboxes and
+    # normalises inside predict(), i.e. on the model thread. Only the native
+    # det/seg services (INFERENCE_BACKEND=native, .pt weights) move that work
+    # into `prepare`; they set `preprocess_in_prepare`.
+    preprocess_in_prepare: bool = False
+
+    def prepare(self, img: Image.Image) -> Any:
+        return img
+
+    def infer(self, x: Any) -> Dict[str, Any]:
+        return self.predict(x)
+
 
 class YOLODetService(BaseService):
     """
@@ -27,7 +63,11 @@ class YOLODetService(BaseService):
     """
 
     def __init__(
-        self, model_path: str | None = None, conf: float = 0.35, iou: float = 0.45
+        self,
+        model_path: str | None = None,
+        conf: float = 0.35,
+        iou: float = 0.45,
+        imgsz: int | None = None,
     ):
         from ultralytics import YOLO
 
@@ -37,13 +77,17 @@ class YOLODetService(BaseService):
             or os.getenv("MODEL_PATH")
             or "yolov8n.pt"
         )
-        self.model = YOLO(mp)
+        mp = mp if model_path else _with_variant(mp, "det")
+        self.model = YOLO(mp, task="detect")
         self.model_version = str(mp)
         self.conf = conf
         self.iou = iou
+        self.kw = {"imgsz": imgsz} if imgsz else {}
 
     def predict(self, img: Image.Image) -> Dict[str, Any]:
-        r = self.model.predict(img, conf=self.conf, iou=self.iou, verbose=False)[0]
+        r = self.model.predict(
+            img, conf=self.conf, iou=self.iou, verbose=False, **self.kw
+        )[0]
         names = r.names
         boxes = r.boxes
         if boxes is None or len(boxes) == 0:
@@ -82,18 +126,27 @@ class YOLOSegService(BaseService):
     """
 
     def __init__(
-        self, model_path: str | None = None, conf: float = 0.35, iou: float = 0.45
+        self,
+        model_path: str | None = None,
+        conf: float = 0.35,
+        iou: float = 0.45,
+        imgsz: int | None = None,
     ):
         from ultralytics import YOLO
 
-        mp = model_path or os.getenv("SEG_MODEL_PATH") or "yolov8n-seg.pt"
-        self.model = YOLO(mp)
+        mp = model_path or _with_variant(
+            os.getenv("SEG_MODEL_PATH") or "yolov8n-seg.pt", "seg"
+        )
+        self.model = YOLO(mp, task="segment")
         self.model_version = str(mp)
         self.conf = conf
         self.iou = iou
+        self.kw = {"imgsz": imgsz} if imgsz else {}
 
     def predict(self, img: Image.Image) -> Dict[str, Any]:
-        r = self.model.predict(img, conf=self.conf, iou=self.iou, verbose=False)[0]
+        r = self.model.predict(
+            img, conf=self.conf, iou=self.iou, verbose=False, **self.kw
+        )[0]
         names = r.names
         masks_out: List[Dict[str, Any]] = []
 
@@ -121,16 +174,21 @@ class YOLOClsService(BaseService):
       }
     """
 
-    def __init__(self, model_path: str | None = None, topk: int = 5):
+    def __init__(
+        self, model_path: str | None = None, topk: int = 5, imgsz: int | None = None
+    ):
         from ultralytics import YOLO
 
-        mp = model_path or os.getenv("CLS_MODEL_PATH") or "yolov8n-cls.pt"
-        self.model = YOLO(mp)
+        mp = model_path or _with_variant(
+            os.getenv("CLS_MODEL_PATH") or "yolov8n-cls.pt", "cls"
+        )
+        self.model = YOLO(mp, task="classify")
         self.model_version = str(mp)
         self.topk = int(os.getenv("CLS_TOPK", topk))
+        self.kw = {"imgsz": imgsz} if imgsz else {}
 
     def predict(self, img: Image.Image) -> Dict[str, Any]:
-        r = self.model.predict(img, verbose=False)[0]
+        r = self.model.predict(img, verbose=False, **self.kw)[0]
         names = r.names  # index -> label
         probs = getattr(r, "probs", None)
 
@@ -146,17 +204,333 @@ class YOLOClsService(BaseService):
 
         return {"topk": pairs, "model_version": self.model_version}
 
+    def embed(self, imgs: List[Image.Image]) -> np.ndarray:
+        """
+        Pooled backbone features for a batch (the input of the classifier's
+        linear layer), L2-normalised; shape (len(imgs), dim).
+        """
+        net = getattr(self.model, "model", None)
+        head = net.model[-1] if hasattr(net, "model") else None
+        if head is None or not hasattr(head, "pool"):
+            raise NotImplementedError("embeddings need PyTorch classification weights")
+        feats: List[Any] = []
+        hook = head.pool.register_forward_hook(
+            lambda _m, _i, out: feats.append(out.flatten(1).detach().float().cpu())
+        )
+        try:
+            self.model.predict(imgs, verbose=False, **self.kw)
+        finally:
+            hook.remove()
+        x = np.concatenate([f.numpy() for f in feats], axis=0)
+        return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+class _LeanPath:
+    """
+    Direct execution of a fused ultralytics nn.Module, skipping the generic
+    predictor (source sniffing, per-call setup, Results objects). Preprocessing
+    matches ultralytics' LetterBox(auto=True) for .pt models bit-for-bit:
+    cv2 INTER_LINEAR resize into a 114-padded array (`prepare`, GIL released),
+    then a copy into a reused float tensor on the model thread (`tensor`).
+    """
+
+    def __init__(self, yolo, imgsz: int | None):
+        import torch
+        from ultralytics.utils.checks import check_imgsz
+
+        if not isinstance(yolo.model, torch.nn.Module):
+            raise TypeError("lean path needs PyTorch weights")
+        self.torch = torch
+        self.net = yolo.model.fuse(verbose=False).eval()
+        self.names = self.net.names
+        self.stride = max(int(self.net.stride.max()), 32)
+        self.imgsz = check_imgsz(
+            imgsz or yolo.overrides.get("imgsz") or 640, stride=self.stride, min_dim=2
+        )
+        self._local = threading.local()  # input tensors are per model thread
+
+    def prepare(self, img: Image.Image):
+        """Returns (padded HxWx3 uint8 RGB, padded (H, W), original (h, w))."""
+        import cv2
+
+        arr = np.asarray(img.convert("RGB"))
+        h0, w0 = arr.shape[:2]
+        nh, nw = self.imgsz
+        r = min(nh / h0, nw / w0)
+        uw, uh = int(round(w0 * r)), int(round(h0 * r))
+        dw, dh = (nw - uw) % self.stride / 2, (nh - uh) % self.stride / 2
+        top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+        H = uh + top + int(round(dh + 0.1))
+        W = uw + left + int(round(dw + 0.1))
+        if (w0, h0) != (uw, uh):
+            arr = cv2.resize(arr, (uw, uh), interpolation=cv2.INTER_LINEAR)
+        out = np.full((H, W, 3), 114, dtype=np.uint8)
+        out[top : top + uh, left : left + uw] = arr
+        return out, (H, W), (h0, w0)
+
+    def tensor(self, arr: np.ndarray):
+        """1x3xHxW float input in [0,1], written into a cached buffer for this shape."""
+        bufs = self._local.__dict__.setdefault("bufs", {})
+        t = bufs.get(arr.shape)
+        if t is None:
+            t = bufs[arr.shape] = self.torch.empty(
+                (1, 3, *arr.shape[:2]), dtype=self.torch.float32
+            )
+        t[0].copy_(self.torch.from_numpy(arr).permute(2, 0, 1))
+        return t.div_(255.0)
+
+    def forward(self, x):
+        return self.net(x)
+
+
+class NativeYOLODetService(YOLODetService):
+    """Same schema as YOLODetService, executed via `_LeanPath` (INFERENCE_BACKEND=native)."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        try:
+            self.lean: Optional[_LeanPath] = _LeanPath(self.model, self.kw.get("imgsz"))
+        except TypeError:  # ONNX / TorchScript: keep the ultralytics path
+            self.lean = None
+        self.preprocess_in_prepare = self.lean is not None
+
+    def predict(self, img: Image.Image) -> Dict[str, Any]:
+        return self.infer(self.prepare(img))
+
+    def prepare(self, img: Image.Image) -> Any:
+        return img if self.lean is None else self.lean.prepare(img)
+
+    def infer(self, x: Any) -> Dict[str, Any]:
+        if self.lean is None:
+            return super().predict(x)
+        from ultralytics.utils import ops
+
+        torch = self.lean.torch
+        with torch.inference_mode():
+            arr, shape, orig = x
+            preds = self.lean.forward(self.lean.tensor(arr))
+            pred = ops.non_max_suppression(preds, self.conf, self.iou, max_det=300)[0]
+            if not len(pred):
+                return {"bboxes": [], "model_version": self.model_version}
+            pred[:, :4] = ops.scale_boxes(shape, pred[:, :4], orig)
+            arr = pred[:, :6].numpy()
+
+        names = self.lean.names
+        bboxes = [
+            {
+                "x1": float(x1),
+                "y1": float(y1),
+                "x2": float(x2),
+                "y2": float(y2),
+                "conf": float(c),
+                "cls": str(names[int(k)]),
+            }
+            for x1, y1, x2, y2, c, k in arr
+        ]
+        return {"bboxes": bboxes, "model_version": self.model_version}
+
+
+class NativeYOLOSegService(YOLOSegService):
+    """Same schema as YOLOSegService; masks are decoded only for instances kept by NMS."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        try:
+            self.lean: Optional[_LeanPath] = _LeanPath(self.model, self.kw.get("imgsz"))
+        except TypeError:  # ONNX / TorchScript: keep the ultralytics path
+            self.lean = None
+        self.preprocess_in_prepare = self.lean is not None
+
+    def predict(self, img: Image.Image) -> Dict[str, Any]:
+        return self.infer(self.prepare(img))
+
+    def prepare(self, img: Image.Image) -> Any:
+        return img if self.lean is None else self.lean.prepare(img)
+
+    def infer(self, x: Any) -> Dict[str, Any]:
+        if self.lean is None:
+            return super().predict(x)
+        from ultralytics.utils import ops
+
+        torch = self.lean.torch
+        names = self.lean.names
+        with torch.inference_mode():
+            arr, shape, orig = x
+            out = self.lean.forward(self.lean.tensor(arr))
+            pred = ops.non_max_suppression(
+                out[0], self.conf, self.iou, max_det=300, nc=len(names)
+            )[0]
+            if not len(pred):
+                return {"masks": [], "model_version": self.model_version}
+            proto = out[1][-1] if isinstance(out[1], tuple) else out[1]
+            masks = ops.process_mask(
+                proto[0], pred[:, 6:], pred[:, :4], shape, upsample=True
+            )
+            polys = [
+                ops.scale_coords(masks.shape[1:], p, orig, normalize=False)
+                for p in ops.masks2segments(masks)
+            ]
+            cls = pred[:, 5].numpy()
+            conf = pred[:, 4].numpy()
+
+        masks_out = [
+            {
+                "points": [[float(px), float(py)] for px, py in poly],
+                "cls": str(names[int(k)]),
+                "conf": float(c),
+            }
+            for poly, k, c in zip(polys, cls, conf)
+        ]
+        return {"masks": masks_out, "model_version": self.model_version}
+
+
+SERVICES = {"det": YOLODetService, "seg": YOLOSegService, "cls": YOLOClsService}
+NATIVE_SERVICES = {"det": NativeYOLODetService, "seg": NativeYOLOSegService}
+
+
+def build_service(task: str, native: bool | None = None, **kwargs: Any) -> BaseService:
+    """
+    Construct a service for `task` ("det" | "seg" | "cls") outside the singletons.
+    `native` (default: INFERENCE_BACKEND=native) selects the lean execution path
+    where one exists; it falls back to ultralytics for non-PyTorch weights.
+    """
+    native = os.getenv("INFERENCE_BACKEND") == "native" if native is None else native
+    if native and task in NATIVE_SERVICES:
+        return NATIVE_SERVICES[task](**kwargs)
+    return SERVICES[task](**kwargs)
+
 
 @lru_cache(maxsize=1)
 def get_det() -> YOLODetService:
-    return YOLODetService()
+    return build_service("det")
 
 
 @lru_cache(maxsize=1)
 def get_seg() -> YOLOSegService:
-    return YOLOSegService()
+    return build_service("seg")
 
 
 @lru_cache(maxsize=1)
 def get_cls() -> YOLOClsService:
     return YOLOClsService()
+
+
+def dhash(img: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: robust to re-encoding / small brightness changes."""
+    g = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    px = g.tobytes()
+    bits = 0
+    for y in range(size):
+        row = px[y * (size + 1) : (y + 1) * (size + 1)]
+        for x in range(size):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return bits
+
+
+def _popcount(x: int) -> int:
+    return bin(x).count("1")
+
+
+class PHashIndex:
+    """
+    Near-duplicate lookup of recent frames per stream, by Hamming distance on
+    64-bit dHash. Multi-index hashing: the hash is split into `chunks` 16-bit
+    substrings, each with its own table; by pigeonhole any hash within
+    `max_distance` matches at least one substring within max_distance // chunks
+    bits, so a lookup probes a few small buckets instead of scanning. Entries are
+    bounded (FIFO over `max_entries`: oldest inserted first, hits do not refresh
+    them) and only reused while younger than `ttl_s`.
+    """
+
+    BITS = 64
+
+    def __init__(
+        self,
+        max_distance: int = 4,
+        max_entries: int = 200_000,
+        ttl_s: float = 10.0,
+        chunks: int = 4,
+    ):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.chunks = chunks
+        self.width = self.BITS // chunks
+        self.mask = (1 << self.width) - 1
+        r = max_distance // chunks
+        # all XOR patterns of <= r bits within one substring
+        self._flips = [0] + [
+            sum(1 << b for b in combo)
+            for k in range(1, r + 1)
+            for combo in itertools.combinations(range(self.width), k)
+        ]
+        self._entries: "OrderedDict[int, Tuple[str, int, Dict[str, Any], float]]" = OrderedDict()
+        self._tables: Dict[Tuple[str, int, int], set] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _subs(self, h: int):
+        return [(i, (h >> (i * self.width)) & self.mask) for i in range(self.chunks)]
+
+    def _drop(self, eid: int) -> None:
+        stream, h, _, _ = self._entries.pop(eid)
+        for i, sub in self._subs(h):
+            key = (stream, i, sub)
+            bucket = self._tables.get(key)
+            if bucket is not None:
+                bucket.discard(eid)
+                if not bucket:
+                    del self._tables[key]
+
+    def lookup(self, stream: str, h: int) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        best: Optional[Tuple[int, float, Dict[str, Any]]] = None
+        with self._lock:
+            for i, sub in self._subs(h):
+                for flip in self._flips:
+                    for eid in self._tables.get((stream, i, sub ^ flip), ()):
+                        _, eh, pred, ts = self._entries[eid]
+                        if now - ts > self.ttl_s:
+                            continue
+                        d = _popcount(eh ^ h)
+                        if d <= self.max_distance and (best is None or (d, -ts) < (best[0], -best[1])):
+                            best = (d, ts, pred)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return best[2]
+
+    def add(self, stream: str, h: int, pred: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            eid = next(self._ids)
+            self._entries[eid] = (stream, h, pred, now)
+            for i, sub in self._subs(h):
+                self._tables.setdefault((stream, i, sub), set()).add(eid)
+            # evict over capacity, then anything expired at the old end
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+            while self._entries:
+                oldest = next(iter(self._entries))
+                if now - self._entries[oldest][3] <= self.ttl_s:
+                    break
+                self._drop(oldest)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@lru_cache(maxsize=None)
+def get_phash(task: str) -> Optional[PHashIndex]:
+    """Per-task near-duplicate index; disabled unless PHASH_MAX_DISTANCE is set (>= 0)."""
+    d = int(os.getenv("PHASH_MAX_DISTANCE", "-1"))
+    if d < 0:
+        return None
+    return PHashIndex(
+        max_distance=d,
+        max_entries=int(os.getenv("PHASH_MAX_ENTRIES", "200000")),
+        ttl_s=float(os.getenv("PHASH_TTL_S", "10")),
+    )
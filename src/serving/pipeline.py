@@ -0,0 +1,311 @@
+"""
+Staged serving path: decode -> preprocess -> infer -> serialize.
+
+Each request image flows through stage workers connected by bounded queues
+instead of being handled start to finish on the request thread:
+
+  decode     PIPELINE_DECODE_WORKERS threads (default 2): base64/JPEG decode,
+             dHash near-duplicate lookup and `service.prepare()`. Letterbox
+             and normalisation only run here for the native det/seg services
+             (INFERENCE_BACKEND=native, .pt weights); with the default
+             ultralytics backend, and always for cls, `prepare` is a
+             pass-through and preprocessing stays inside the infer stage.
+             PIL decoding and cv2 resizing release the GIL.
+  infer      the scheduler's model thread(s): priority/deadline ordering as
+             before, at most PIPELINE_QUEUE jobs in flight.
+  serialize  PIPELINE_SERIALIZE_WORKERS threads (default 1): JSON encoding.
+
+Every stage orders its queue like the scheduler: priority class first, then
+earliest deadline, so interactive frames never wait behind a batch job's
+decode or encode. Items whose deadline passed are shed when popped.
+
+Near-duplicate reuse (dHash) only applies to requests with an X-Stream-Id;
+without one every frame runs the model.
+
+Sampled frames are also handed to the shadow mirror (see shadow.py) once the
+primary prediction is back; that never blocks the request.
+
+A full queue blocks the submitter until there is room or its deadline passes
+(back-pressure rather than unbounded buffering), so while one image is in the
+forward pass the next ones are already being decoded and the previous ones
+encoded; throughput tends towards the slowest stage instead of the sum. With
+the default backend the infer stage also carries preprocessing, so the overlap
+covers decode and encode only.
+
+Per-stage counters (GET /pipeline) are cumulative since start: busy seconds,
+items, errors, shed, queue depth and utilization = busy / (uptime * workers).
+`preprocess` reports per task served so far whether letterbox/normalisation
+runs in the decode stage or inside infer.
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from .inference import BaseService, dhash, get_cls, get_det, get_phash, get_seg
+from .prediction_store import get_store
+from .profiling import PROFILER
+from .scheduler import PRIORITIES, DeadlineExceeded, Scheduler, get_scheduler
+from .shadow import get_shadow
+
+GETTERS: Dict[str, Callable[[], BaseService]] = {
+    "det": get_det,
+    "seg": get_seg,
+    "cls": get_cls,
+}
+
+Blob = Union[bytes, str]  # raw image bytes, or base64 text from the /v1 routes
+
+
+class StageStats:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.started = time.monotonic()
+        self.busy_s = 0.0
+        self.items = 0
+        self.errors = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def add(self, t0: float, error: bool = False) -> None:
+        dt = time.perf_counter() - t0
+        with self._lock:
+            self.busy_s += dt
+            self.items += 1
+            self.errors += int(error)
+
+    def snapshot(self, queued: int) -> Dict[str, Any]:
+        uptime = max(1e-9, time.monotonic() - self.started)
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "errors": self.errors,
+            "shed": self.shed,
+            "queued": queued,
+            "busy_s": round(self.busy_s, 3),
+            "mean_ms": round(1000 * self.busy_s / max(1, self.items), 3),
+            "utilization": round(self.busy_s / (uptime * self.workers), 4),
+        }
+
+
+class Stage:
+    """
+    Worker threads draining a bounded priority queue ordered by (class rank,
+    deadline); `submit` blocks while it is full.
+    """
+
+    def __init__(self, name: str, workers: int, maxsize: int):
+        self.name = name
+        self._q: "queue.PriorityQueue[Tuple[int, float, int, Callable[..., Any], tuple, Future]]" = (
+            queue.PriorityQueue(maxsize)
+        )
+        # tie-break so equal (rank, deadline) stay FIFO and fn is never compared
+        self._seq = itertools.count()
+        self._stats = StageStats(name, max(1, workers))
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"{name}-{i}", daemon=True)
+            for i in range(self._stats.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(
+        self, fn: Callable[..., Any], *args: Any, cls: str, deadline: float
+    ) -> Future:
+        if cls not in PRIORITIES:
+            raise ValueError(f"unknown priority class {cls!r}")
+        fut: Future = Future()
+        try:
+            self._q.put(
+                (PRIORITIES[cls], deadline, next(self._seq), fn, args, fut),
+                timeout=max(0.0, deadline - time.monotonic()),
+            )
+        except queue.Full as e:
+            self._stats.shed += 1
+            raise DeadlineExceeded(f"{self.name} queue full until the deadline") from e
+        return fut
+
+    def _loop(self) -> None:
+        while True:
+            _, deadline, _, fn, args, fut = self._q.get()
+            if time.monotonic() >= deadline or not fut.set_running_or_notify_cancel():
+                self._stats.shed += 1
+                if not fut.done():
+                    fut.set_exception(DeadlineExceeded("shed before running"))
+                continue
+            t0 = time.perf_counter()
+            try:
+                res = fn(*args)
+            except BaseException as e:  # surface to the waiting request thread
+                self._stats.add(t0, error=True)
+                fut.set_exception(e)
+                continue
+            self._stats.add(t0)
+            fut.set_result(res)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._stats.snapshot(self._q.qsize())
+
+
+class InferStage:
+    """
+    Model calls on the scheduler's worker thread(s), at most `maxsize` in flight.
+    Futures resolve to (result, forward ms).
+    """
+
+    name = "infer"
+
+    def __init__(self, sched: Scheduler, maxsize: int):
+        self.sched = sched
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self._stats = StageStats(self.name, sched.workers)
+
+    def submit(
+        self, fn: Callable[..., Any], *args: Any, cls: str, deadline: float
+    ) -> Future:
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            self._stats.shed += 1
+            raise DeadlineExceeded("infer queue full until the deadline")
+        with self._lock:
+            self._inflight += 1
+
+        def job() -> Tuple[Any, float]:
+            t0 = time.perf_counter()
+            try:
+                res = PROFILER.call(fn, *args)
+            except BaseException:
+                self._stats.add(t0, error=True)
+                raise
+            self._stats.add(t0)
+            return res, (time.perf_counter() - t0) * 1000
+
+        fut = self.sched.submit(job, cls, deadline)
+        fut.add_done_callback(self._release)
+        return fut
+
+    def _release(self, _: Future) -> None:
+        with self._lock:
+            self._inflight -= 1
+        self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._stats.snapshot(self._inflight)
+
+
+def _dumps(pred: Dict[str, Any]) -> bytes:
+    # same encoding as fastapi.responses.JSONResponse.render
+    return json.dumps(
+        pred, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class Pipeline:
+    def __init__(
+        self,
+        decode_workers: int = 2,
+        serialize_workers: int = 1,
+        maxsize: int = 64,
+        sched: Optional[Scheduler] = None,
+    ):
+        self.decode = Stage("decode", decode_workers, maxsize)
+        self.infer = InferStage(sched or get_scheduler(), maxsize)
+        self.serialize = Stage("serialize", serialize_workers, maxsize)
+        self.preprocess: Dict[str, str] = {}  # task -> "decode" | "infer"
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            s.name: s.stats() for s in (self.decode, self.infer, self.serialize)
+        }
+        out["preprocess"] = dict(self.preprocess)
+        return out
+
+    @staticmethod
+    def _decode(
+        blob: Blob, svc: BaseService, index: Any, stream: str, keep: bool
+    ) -> Tuple[Any, Optional[int], Optional[Dict[str, Any]], Optional[Image.Image]]:
+        """-> (prepared input, dhash, reused prediction or None, image if `keep`)."""
+        raw = base64.b64decode(blob) if isinstance(blob, str) else blob
+        img = Image.open(io.BytesIO(raw)).convert("RGB")
+        h = None
+        if index is not None:
+            h = dhash(img)
+            hit = index.lookup(stream, h)
+            if hit is not None:  # near-duplicate of a recent frame: skip the model
+                return None, h, {**hit, "reused": True}, None
+        return svc.prepare(img), h, None, img if keep else None
+
+    def run(
+        self,
+        task: str,
+        blobs: List[Blob],
+        stream: Optional[str],
+        cls: str,
+        deadline: float,
+    ) -> List[bytes]:
+        """JSON-encoded prediction per blob, in order; DeadlineExceeded if any is late."""
+        svc = GETTERS[task]()
+        self.preprocess[task] = "decode" if svc.preprocess_in_prepare else "infer"
+        index = get_phash(task) if stream else None
+        shadow = get_shadow()
+        decoded = [
+            self.decode.submit(
+                self._decode,
+                b,
+                svc,
+                index,
+                stream,
+                shadow is not None and shadow.sample(task),
+                cls=cls,
+                deadline=deadline,
+            )
+            for b in blobs
+        ]
+        # hand each image to the model thread as soon as it is decoded
+        slots: List[Tuple[Any, Optional[int], Optional[Image.Image]]] = []
+        for f in decoded:
+            x, h, hit, img = Scheduler.wait(f, cls, deadline)
+            if hit is None:
+                hit = self.infer.submit(svc.infer, x, cls=cls, deadline=deadline)
+            slots.append((hit, h, img))
+        store = get_store()
+        encoded: List[Future] = []
+        for s, h, img in slots:
+            if isinstance(s, dict):
+                pred = s
+            else:
+                pred, ms = Scheduler.wait(s, cls, deadline)
+                if img is not None:
+                    shadow.mirror(task, img, pred, ms)
+                if index is not None:
+                    index.add(stream, h, pred)
+                    pred = {**pred, "reused": False}
+            if store is not None:
+                store.record(task, stream or "anon", pred)
+            encoded.append(
+                self.serialize.submit(_dumps, pred, cls=cls, deadline=deadline)
+            )
+        return [Scheduler.wait(f, cls, deadline) for f in encoded]
+
+
+@lru_cache(maxsize=1)
+def get_pipeline() -> Pipeline:
+    return Pipeline(
+        decode_workers=int(os.getenv("PIPELINE_DECODE_WORKERS", "2")),
+        serialize_workers=int(os.getenv("PIPELINE_SERIALIZE_WORKERS", "1")),
+        maxsize=int(os.getenv("PIPELINE_QUEUE", "64")),
+    )
@@ -0,0 +1,311 @@
+"""
+Optional indexed sink for every prediction the API returns (SQLite, WAL mode).
+
+Enabled with PREDICTION_STORE=/path/to/predictions.db. Writes are queued and
+committed by a background thread in batches, so the request path only pays for
+a `queue.put_nowait` (records are dropped and counted if the queue is full).
+
+Schema:
+  predictions(id, ts, source, task, model_version, n_objects, payload)
+  objects(pred_id, ts, source, task, cls, conf, x1, y1, x2, y2)
+with indexes on (ts), (source, ts), (task, ts) and (cls, conf, ts), (pred_id, cls)
+so filters like "frames from camera X with a person but no helmet last week"
+are index range scans, not full-table scans:
+
+  python -m src.serving.prediction_store query --db preds.db --source cam-3 \\
+      --cls person --absent-cls helmet --since 2026-10-12 --min-conf 0.5
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    source TEXT NOT NULL,
+    task TEXT NOT NULL,
+    model_version TEXT,
+    n_objects INTEGER NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS objects (
+    pred_id INTEGER NOT NULL REFERENCES predictions(id),
+    ts REAL NOT NULL,
+    source TEXT NOT NULL,
+    task TEXT NOT NULL,
+    cls TEXT NOT NULL,
+    conf REAL NOT NULL,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL
+);
+CREATE INDEX IF NOT EXISTS ix_pred_ts ON predictions(ts);
+CREATE INDEX IF NOT EXISTS ix_pred_source_ts ON predictions(source, ts);
+CREATE INDEX IF NOT EXISTS ix_pred_task_ts ON predictions(task, ts);
+CREATE INDEX IF NOT EXISTS ix_obj_cls_conf_ts ON objects(cls, conf, ts);
+CREATE INDEX IF NOT EXISTS ix_obj_source_cls_ts ON objects(source, cls, ts);
+CREATE INDEX IF NOT EXISTS ix_obj_pred_cls ON objects(pred_id, cls, conf);
+"""
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _objects(
+    task: str, pred: Dict[str, Any]
+) -> List[Tuple[str, float, Any, Any, Any, Any]]:
+    """Flatten a service response into (cls, conf, x1, y1, x2, y2) rows."""
+    if task == "det":
+        return [
+            (b["cls"], b["conf"], b["x1"], b["y1"], b["x2"], b["y2"])
+            for b in pred.get("bboxes", [])
+        ]
+    if task == "seg":
+        rows = []
+        for m in pred.get("masks", []):
+            xs = [p[0] for p in m["points"]] or [None]
+            ys = [p[1] for p in m["points"]] or [None]
+            box = (
+                (min(xs), min(ys), max(xs), max(ys))
+                if xs[0] is not None
+                else (None,) * 4
+            )
+            rows.append((m["cls"], m["conf"], *box))
+        return rows
+    if task == "cls":
+        return [(label, p, None, None, None, None) for label, p in pred.get("topk", [])]
+    return []
+
+
+class PredictionStore:
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 256,
+        flush_s: float = 1.0,
+        max_queue: int = 10_000,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self._q: "queue.Queue[Tuple[float, str, str, Dict[str, Any]]]" = queue.Queue(
+            max_queue
+        )
+        self._conn = _connect(path)
+        self.written = 0
+        self.dropped = 0
+        self._thread = threading.Thread(
+            target=self._writer, name="prediction-store", daemon=True
+        )
+        self._thread.start()
+
+    # ------------------------------------------------------------ write path
+
+    def record(
+        self, task: str, source: str, pred: Dict[str, Any], ts: Optional[float] = None
+    ) -> None:
+        """Non-blocking; called from the request path."""
+        try:
+            self._q.put_nowait((ts or time.time(), source, task, pred))
+        except queue.Full:
+            self.dropped += 1
+
+    def _writer(self) -> None:
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.flush_s
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(
+                        self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                    )
+                except queue.Empty:
+                    break
+            try:
+                self._insert(batch)
+            except sqlite3.Error as e:  # never let a bad batch kill the writer
+                print(f"[prediction_store] insert failed: {e}")
+            for _ in batch:
+                self._q.task_done()
+
+    def _insert(self, batch: Iterable[Tuple[float, str, str, Dict[str, Any]]]) -> None:
+        with self._conn:
+            for ts, source, task, pred in batch:
+                objs = _objects(task, pred)
+                cur = self._conn.execute(
+                    "INSERT INTO predictions(ts, source, task, model_version, n_objects, payload)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        ts,
+                        source,
+                        task,
+                        pred.get("model_version"),
+                        len(objs),
+                        json.dumps(pred),
+                    ),
+                )
+                pid = cur.lastrowid
+                self._conn.executemany(
+                    "INSERT INTO objects(pred_id, ts, source, task, cls, conf, x1, y1, x2, y2)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(pid, ts, source, task, *o) for o in objs],
+                )
+                self.written += 1
+
+    def flush(self) -> None:
+        self._q.join()
+
+    # ------------------------------------------------------------ read path
+
+    def query(self, **filters: Any) -> List[Dict[str, Any]]:
+        # separate read connection: WAL readers never block the writer thread
+        conn = sqlite3.connect(self.path)
+        try:
+            return query(conn, **filters)
+        finally:
+            conn.close()
+
+
+def _build(
+    source: Optional[str] = None,
+    task: Optional[str] = None,
+    cls: Optional[str] = None,
+    absent_cls: Optional[str] = None,
+    min_conf: float = 0.0,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 100,
+    payload: bool = False,
+) -> Tuple[str, List[Any]]:
+    """
+    SQL for frames matching all filters, newest first. `cls`/`min_conf` require an object
+    of that class at or above the confidence; `absent_cls` requires that no
+    object of that class reaches `min_conf` in the same frame.
+    """
+    where, args = [], []
+    if source is not None:
+        where.append("p.source = ?")
+        args.append(source)
+    if task is not None:
+        where.append("p.task = ?")
+        args.append(task)
+    if since is not None:
+        where.append("p.ts >= ?")
+        args.append(since)
+    if until is not None:
+        where.append("p.ts < ?")
+        args.append(until)
+    if cls is not None:
+        where.append(
+            "p.id IN (SELECT o.pred_id FROM objects o WHERE o.cls = ? AND o.conf >= ?"
+            + (" AND o.source = ?" if source is not None else "")
+            + (" AND o.ts >= ?" if since is not None else "")
+            + (" AND o.ts < ?" if until is not None else "")
+            + ")"
+        )
+        args += [cls, min_conf]
+        args += [a for a in (source, since, until) if a is not None]
+    if absent_cls is not None:
+        where.append(
+            "NOT EXISTS (SELECT 1 FROM objects a WHERE a.pred_id = p.id AND a.cls = ? AND a.conf >= ?)"
+        )
+        args += [absent_cls, min_conf]
+    sql = (
+        "SELECT p.id, p.ts, p.source, p.task, p.model_version, p.n_objects"
+        + (", p.payload" if payload else "")
+        + " FROM predictions p"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " ORDER BY p.ts DESC LIMIT ?"
+    )
+    args.append(int(limit))
+    return sql, args
+
+
+def query(conn: sqlite3.Connection, **filters: Any) -> List[Dict[str, Any]]:
+    """Frames matching `filters` (see `_build`), newest first."""
+    sql, args = _build(**filters)
+    payload = filters.get("payload", False)
+    cols = ["id", "ts", "source", "task", "model_version", "n_objects"]
+    rows = [dict(zip(cols + ["payload"] * payload, r)) for r in conn.execute(sql, args)]
+    for r in rows:
+        if payload:
+            r["payload"] = json.loads(r["payload"])
+    return rows
+
+
+def explain(conn: sqlite3.Connection, **filters: Any) -> List[str]:
+    """Query plan for `query(**filters)`; handy to confirm indexes are used."""
+    sql, args = _build(**filters)
+    return [r[-1] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, args)]
+
+
+@lru_cache(maxsize=1)
+def get_store() -> Optional[PredictionStore]:
+    path = os.getenv("PREDICTION_STORE")
+    if not path:
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return PredictionStore(path)
+
+
+def _ts(s: Optional[str]) -> Optional[float]:
+    if s is None:
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        return datetime.fromisoformat(s).timestamp()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Query stored predictions.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    q = sub.add_parser("query")
+    q.add_argument("--db", default=os.getenv("PREDICTION_STORE", "predictions.db"))
+    q.add_argument("--source")
+    q.add_argument("--task", choices=["det", "seg", "cls"])
+    q.add_argument("--cls")
+    q.add_argument("--absent-cls")
+    q.add_argument("--min-conf", type=float, default=0.0)
+    q.add_argument("--since", help="epoch seconds or ISO date")
+    q.add_argument("--until", help="epoch seconds or ISO date")
+    q.add_argument("--limit", type=int, default=100)
+    q.add_argument("--payload", action="store_true")
+    q.add_argument("--explain", action="store_true")
+    a = ap.parse_args(argv)
+
+    conn = _connect(a.db)
+    filters = dict(
+        source=a.source,
+        task=a.task,
+        cls=a.cls,
+        absent_cls=a.absent_cls,
+        min_conf=a.min_conf,
+        since=_ts(a.since),
+        until=_ts(a.until),
+        limit=a.limit,
+        payload=a.payload,
+    )
+    if a.explain:
+        print("\n".join(explain(conn, **filters)))
+        return
+    for row in query(conn, **filters):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
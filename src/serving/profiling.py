@@ -0,0 +1,241 @@
+"""
+On-demand profiling of live inference calls (POST /debug/profile).
+
+While a session is armed, every call routed through `PROFILER.call()` is
+  - sampled by a background thread reading `sys._current_frames()` of the
+    threads executing profiled calls (folded stacks -> flamegraph/speedscope),
+  - wrapped in `torch.profiler` (per-operator CPU time + allocations, one
+    Chrome trace per call),
+  - covered by `tracemalloc` (top allocation sites and peak traced memory).
+The session ends after N calls or a time window and is returned as a zip.
+Closing it stops new calls from being profiled and waits for the ones in
+flight, so nothing is added to the session while the zip is being built.
+
+When no session is armed `call()` is a single attribute check, so there is no
+measurable overhead in normal serving.
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Set
+
+
+class ProfileSession:
+    def __init__(
+        self,
+        max_calls: int = 10,
+        seconds: float = 30.0,
+        interval_ms: float = 5.0,
+        torch_profile: bool = True,
+        memory: bool = True,
+    ):
+        self.max_calls = max(1, max_calls)
+        self.seconds = seconds
+        self.interval = max(0.001, interval_ms / 1000)
+        self.torch_profile = torch_profile
+        self.memory = memory
+        self.started = time.monotonic()
+        self.calls = 0
+        self.call_ms: List[float] = []
+        self.stacks: Counter = Counter()
+        self.ops: Dict[str, Dict[str, float]] = {}
+        self.traces: List[str] = []
+        self.threads: Set[int] = set()
+        self.done = threading.Event()
+        self._finished = False
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._closed = False  # no new profiled calls once set
+        self._inflight = 0
+        self._sealed = False  # artifact built: late traces are discarded
+        self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+        self.mem_top: List[str] = []
+        self.mem_peak = 0
+
+    # ------------------------------------------------------------ lifecycle
+
+    def start(self) -> None:
+        if self.memory:
+            tracemalloc.start(25)
+        self._sampler.start()
+
+    def expired(self) -> bool:
+        return self.calls >= self.max_calls or time.monotonic() - self.started >= self.seconds
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Refuse new profiled calls and wait (up to `timeout`) for those in flight."""
+        with self._idle:
+            self._closed = True
+            self._idle.wait_for(lambda: self._inflight == 0, timeout)
+
+    def finish(self) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        self.done.set()
+        self._sampler.join(timeout=1.0)
+        if self.memory and tracemalloc.is_tracing():
+            snap = tracemalloc.take_snapshot()
+            self.mem_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.mem_top = [str(s) for s in snap.statistics("lineno")[:40]]
+
+    # ------------------------------------------------------------ sampling
+
+    @staticmethod
+    def _fold(frame) -> str:
+        parts = []
+        while frame is not None:
+            co = frame.f_code
+            parts.append(f"{co.co_name} ({os.path.basename(co.co_filename)}:{co.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    def _sample(self) -> None:
+        while not self.done.wait(self.interval):
+            with self._lock:
+                tids = list(self.threads)
+            if not tids:
+                continue
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            for tid in tids:
+                f = frames.get(tid)
+                if f is not None:
+                    self.stacks[self._fold(f)] += 1
+
+    # ------------------------------------------------------------ calls
+
+    def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        tid = threading.get_ident()
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._inflight += 1
+                self.threads.add(tid)
+        if closed:  # raced with close(): run unprofiled
+            return fn(*args)
+        try:
+            return self._run(tid, fn, *args)
+        finally:
+            with self._idle:
+                self._inflight -= 1
+                self._idle.notify_all()
+
+    def _run(self, tid: int, fn: Callable[..., Any], *args: Any) -> Any:
+        prof = None
+        if self.torch_profile:
+            try:
+                from torch.profiler import ProfilerActivity, profile
+
+                prof = profile(activities=[ProfilerActivity.CPU], profile_memory=True, record_shapes=True)
+            except ImportError:
+                prof = None
+        t0 = time.perf_counter()
+        try:
+            if prof is None:
+                return fn(*args)
+            with prof:
+                return fn(*args)
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            with self._lock:
+                self.threads.discard(tid)
+                self.calls += 1
+                self.call_ms.append(ms)
+                n = self.calls
+            if prof is not None:
+                self._collect_torch(prof, n)
+
+    def _collect_torch(self, prof, n: int) -> None:
+        path = os.path.join(tempfile.gettempdir(), f"torch_trace_{os.getpid()}_{id(self)}_{n}.json")
+        prof.export_chrome_trace(path)
+        with self._lock:
+            if self._sealed:  # close() timed out on this call; the zip is gone
+                os.unlink(path)
+                return
+            self.traces.append(path)
+            for ev in prof.key_averages():
+                o = self.ops.setdefault(
+                    ev.key,
+                    {"count": 0, "cpu_time_total_us": 0.0, "self_cpu_time_total_us": 0.0, "cpu_memory_bytes": 0},
+                )
+                o["count"] += ev.count
+                o["cpu_time_total_us"] += ev.cpu_time_total
+                o["self_cpu_time_total_us"] += ev.self_cpu_time_total
+                o["cpu_memory_bytes"] += getattr(ev, "self_cpu_memory_usage", 0)
+
+    # ------------------------------------------------------------ artifact
+
+    def artifact(self) -> bytes:
+        buf = io.BytesIO()
+        with self._lock:
+            self._sealed = True
+            ops = sorted(self.ops.items(), key=lambda kv: -kv[1]["self_cpu_time_total_us"])
+            calls, call_ms, traces = self.calls, list(self.call_ms), list(self.traces)
+        summary = {
+            "calls": calls,
+            "call_ms": call_ms,
+            "samples": sum(self.stacks.values()),
+            "interval_ms": self.interval * 1000,
+            "tracemalloc_peak_bytes": self.mem_peak,
+            "top_ops": [{"op": k, **v} for k, v in ops[:30]],
+        }
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("summary.json", json.dumps(summary, indent=2))
+            # Brendan Gregg folded format: flamegraph.pl / speedscope / inferno
+            z.writestr("stacks.folded", "".join(f"{k} {v}\n" for k, v in self.stacks.most_common()))
+            z.writestr("torch_ops.json", json.dumps(dict(ops), indent=2))
+            z.writestr("tracemalloc_top.txt", "\n".join(self.mem_top))
+            for i, path in enumerate(traces):
+                z.write(path, f"torch_trace_{i:03d}.json")
+        for path in traces:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        return buf.getvalue()
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.session: Optional[ProfileSession] = None
+        self._lock = threading.Lock()
+
+    def call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        s = self.session
+        if s is None:  # fast path: not profiling
+            return fn(*args)
+        try:
+            return s.run(fn, *args)
+        finally:
+            if s.expired():
+                s.done.set()
+
+    def profile(self, session: ProfileSession) -> bytes:
+        """Arm `session`, block until it completes, disarm and return the zip artifact."""
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError("a profiling session is already running")
+            session.start()
+            self.session = session
+        try:
+            session.done.wait(timeout=session.seconds)
+        finally:
+            with self._lock:
+                self.session = None
+            session.close()  # calls that already picked up the session finish first
+            session.finish()
+        return session.artifact()
+
+
+PROFILER = Profiler()
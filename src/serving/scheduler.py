@@ -0,0 +1,145 @@
+"""
+Deadline-aware priority scheduler in front of the model services.
+
+Every inference call is queued as a job with a priority class and an absolute
+deadline. Worker threads (SCHED_WORKERS, default 1 so the models are never
+entered concurrently) always take the highest priority class first and,
+within a class, the earliest deadline. Jobs whose deadline has already passed
+when they reach the head of the queue are shed without running and counted per
+class.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+# lower value = served first
+PRIORITIES: Dict[str, int] = {"interactive": 0, "batch": 1}
+
+# default deadline budget (seconds) when the client does not send X-Deadline-Ms
+DEFAULT_BUDGET_S: Dict[str, float] = {
+    "interactive": float(os.getenv("SCHED_INTERACTIVE_BUDGET_S", "15")),
+    "batch": float(os.getenv("SCHED_BATCH_BUDGET_S", "120")),
+}
+
+
+class DeadlineExceeded(Exception):
+    """The job's deadline passed before it could run."""
+
+
+@dataclass(order=True)
+class _Job:
+    rank: int
+    deadline: float
+    seq: int
+    cls: str = field(compare=False)
+    fn: Callable[[], Any] = field(compare=False)
+    future: Future = field(compare=False)
+    enqueued: float = field(compare=False, default_factory=time.monotonic)
+
+
+class Scheduler:
+    def __init__(self, workers: int = 1):
+        self._heap: List[_Job] = []
+        self._cv = threading.Condition()
+        self._seq = itertools.count()
+        self._stats: Dict[str, Dict[str, float]] = {
+            c: {"served": 0, "shed": 0, "late": 0, "errors": 0, "wait_s": 0.0} for c in PRIORITIES
+        }
+        self.workers = max(1, workers)
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"sched-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, fn: Callable[[], Any], cls: str, deadline: float) -> Future:
+        """Queue `fn`; `deadline` is absolute `time.monotonic()` seconds."""
+        if cls not in PRIORITIES:
+            raise ValueError(f"unknown priority class {cls!r}")
+        fut: Future = Future()
+        job = _Job(PRIORITIES[cls], deadline, next(self._seq), cls, fn, fut)
+        with self._cv:
+            heapq.heappush(self._heap, job)
+            self._cv.notify()
+        return fut
+
+    def run(self, fn: Callable[[], Any], cls: str, deadline: float) -> Any:
+        """Submit and wait; raises DeadlineExceeded if shed or not done by the deadline."""
+        return self.wait(self.submit(fn, cls, deadline), cls, deadline)
+
+    @staticmethod
+    def wait(fut: Future, cls: str, deadline: float) -> Any:
+        try:
+            return fut.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout as e:
+            # still queued -> it will be shed when popped; running -> result is dropped
+            raise DeadlineExceeded(f"{cls} request exceeded its deadline") from e
+
+    def _loop(self) -> None:
+        while True:
+            with self._cv:
+                while not self._heap:
+                    self._cv.wait()
+                job = heapq.heappop(self._heap)
+            st = self._stats[job.cls]
+            now = time.monotonic()
+            st["wait_s"] += now - job.enqueued
+            if now >= job.deadline or not job.future.set_running_or_notify_cancel():
+                st["shed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(DeadlineExceeded("shed before running"))
+                continue
+            try:
+                res = job.fn()
+            except BaseException as e:  # surface to the waiting request thread
+                st["errors"] += 1
+                job.future.set_exception(e)
+                continue
+            st["served"] += 1
+            if time.monotonic() > job.deadline:
+                st["late"] += 1
+            job.future.set_result(res)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            queued = {c: 0 for c in PRIORITIES}
+            for j in self._heap:
+                queued[j.cls] += 1
+        return {
+            c: {**s, "queued": queued[c]}
+            for c, s in self._stats.items()
+        }
+
+
+_SCHED: Optional[Scheduler] = None
+_SCHED_LOCK = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    global _SCHED
+    with _SCHED_LOCK:
+        if _SCHED is None:
+            _SCHED = Scheduler(int(os.getenv("SCHED_WORKERS", "1")))
+        return _SCHED
+
+
+def parse_deadline(
+    default_cls: str, priority: Optional[str], deadline_ms: Optional[str]
+) -> tuple[str, float]:
+    """Resolve (class, absolute monotonic deadline) from optional headers and the route default."""
+    cls = priority if priority in PRIORITIES else default_cls
+    try:
+        budget = float(deadline_ms) / 1000 if deadline_ms else DEFAULT_BUDGET_S[cls]
+    except ValueError:
+        budget = DEFAULT_BUDGET_S[cls]
+    return cls, time.monotonic() + budget
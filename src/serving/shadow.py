@@ -0,0 +1,309 @@
+"""
+Shadow traffic: mirror a sample of live requests to a candidate model.
+
+Enabled per task by pointing SHADOW_{DET,SEG,CLS}_MODEL at candidate weights
+(e.g. models/weights.pt from train.py). For a SHADOW_SAMPLE fraction of the
+frames the primary model actually ran on (pHash-reused frames are not
+mirrored), the decoded image and the primary prediction are handed to a single
+low-priority (niced) thread that runs the candidate and compares:
+
+  latency    p50/p90/p99/mean of primary vs candidate `infer` time (ms); the
+             candidate's `prepare` runs outside the timer, as the primary's
+             does in the pipeline's decode stage
+  det / seg  greedy same-class box matching at IoU >= SHADOW_IOU (seg boxes
+             are the polygon extents): matched, primary-only, candidate-only,
+             mean IoU of matches, F1 agreement
+  cls        top-1 agreement, and whether each top-1 is in the other's top-k
+
+The request path only pays for a `put_nowait`: the queue is small and full
+means dropped. The mirror also skips work while the machine is busy (system
+CPU above SHADOW_MAX_CPU, or primary jobs waiting in the scheduler), so the
+primary latency is unaffected. Reports are running totals, served at GET /shadow.
+"""
+
+from __future__ import annotations
+
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .inference import BaseService, build_service
+from .scheduler import get_scheduler
+
+TASKS = ("det", "seg", "cls")
+
+
+def _boxes(task: str, pred: Dict[str, Any]) -> Tuple[np.ndarray, List[str]]:
+    """(N,4) xyxy boxes and class names of a det/seg response."""
+    if task == "det":
+        items = pred.get("bboxes", [])
+        xyxy = [[b["x1"], b["y1"], b["x2"], b["y2"]] for b in items]
+    else:
+        items = [m for m in pred.get("masks", []) if m["points"]]
+        xyxy = []
+        for m in items:
+            p = np.asarray(m["points"], dtype=np.float32)
+            xyxy.append([*p.min(0), *p.max(0)])
+    return np.asarray(xyxy, dtype=np.float32).reshape(-1, 4), [b["cls"] for b in items]
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(-1)
+    area_a = (a[:, 2:] - a[:, :2]).prod(-1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(-1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match_boxes(
+    task: str, primary: Dict[str, Any], candidate: Dict[str, Any], thr: float
+) -> Tuple[int, int, int, float]:
+    """Greedy same-class matching by IoU -> (matched, primary-only, candidate-only, sum IoU)."""
+    pa, pc = _boxes(task, primary)
+    ca, cc = _boxes(task, candidate)
+    iou = _iou(pa, ca)
+    if iou.size:
+        iou[np.asarray(pc)[:, None] != np.asarray(cc)[None, :]] = 0.0
+    matched, total = 0, 0.0
+    while iou.size and iou.max() >= thr:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        matched += 1
+        total += float(iou[i, j])
+        iou[i, :] = 0.0
+        iou[:, j] = 0.0
+    return matched, len(pa) - matched, len(ca) - matched, total
+
+
+def _pct(xs: Deque[float]) -> Dict[str, float]:
+    if not xs:
+        return {}
+    a = np.asarray(xs)
+    return {
+        "p50_ms": float(np.percentile(a, 50)),
+        "p90_ms": float(np.percentile(a, 90)),
+        "p99_ms": float(np.percentile(a, 99)),
+        "mean_ms": float(a.mean()),
+    }
+
+
+class ShadowReport:
+    """Running comparison for one task; latency keeps the last `window` frames."""
+
+    def __init__(self, task: str, model_path: str, iou: float, window: int = 10_000):
+        self.task = task
+        self.model_path = model_path
+        self.iou = iou
+        self.frames = 0
+        self.errors = 0
+        self.primary_ms: Deque[float] = deque(maxlen=window)
+        self.candidate_ms: Deque[float] = deque(maxlen=window)
+        self.counts = {
+            "matched": 0,
+            "primary_only": 0,
+            "candidate_only": 0,
+            "iou_sum": 0.0,
+            "top1_agree": 0,
+            "p_top1_in_c_topk": 0,
+            "c_top1_in_p_topk": 0,
+        }
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        primary: Dict[str, Any],
+        candidate: Dict[str, Any],
+        primary_ms: float,
+        candidate_ms: float,
+    ) -> None:
+        if self.task == "cls":
+            p = [label for label, _ in primary.get("topk", [])]
+            c = [label for label, _ in candidate.get("topk", [])]
+            upd = {
+                "top1_agree": int(bool(p and c and p[0] == c[0])),
+                "p_top1_in_c_topk": int(bool(p and p[0] in c)),
+                "c_top1_in_p_topk": int(bool(c and c[0] in p)),
+            }
+        else:
+            m, po, co, s = match_boxes(self.task, primary, candidate, self.iou)
+            upd = {"matched": m, "primary_only": po, "candidate_only": co, "iou_sum": s}
+        with self._lock:
+            self.frames += 1
+            self.primary_ms.append(primary_ms)
+            self.candidate_ms.append(candidate_ms)
+            for k, v in upd.items():
+                self.counts[k] += v
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self.counts)
+            out: Dict[str, Any] = {
+                "candidate": self.model_path,
+                "frames": self.frames,
+                "errors": self.errors,
+                "latency": {
+                    "primary": _pct(self.primary_ms),
+                    "candidate": _pct(self.candidate_ms),
+                },
+            }
+        n = max(1, self.frames)
+        if self.task == "cls":
+            out["agreement"] = {
+                "top1": c["top1_agree"] / n,
+                "primary_top1_in_candidate_topk": c["p_top1_in_c_topk"] / n,
+                "candidate_top1_in_primary_topk": c["c_top1_in_p_topk"] / n,
+            }
+        else:
+            m, po, co = c["matched"], c["primary_only"], c["candidate_only"]
+            out["agreement"] = {
+                "iou_threshold": self.iou,
+                "matched": m,
+                "primary_only": po,
+                "candidate_only": co,
+                "mean_iou": c["iou_sum"] / max(1, m),
+                "f1": 2 * m / max(1, 2 * m + po + co),
+            }
+        return out
+
+
+class _CpuMeter:
+    """System-wide CPU busy fraction from /proc/stat deltas (load average elsewhere)."""
+
+    def __init__(self, min_interval_s: float = 0.5):
+        self.min_interval_s = min_interval_s
+        self._last: Optional[Tuple[float, int, int]] = None
+        self.value = 0.0
+
+    @staticmethod
+    def _read() -> Optional[Tuple[int, int]]:
+        try:
+            with open("/proc/stat") as f:
+                v = [int(x) for x in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        idle = v[3] + (v[4] if len(v) > 4 else 0)  # idle + iowait
+        return sum(v), idle
+
+    def busy(self) -> float:
+        now = time.monotonic()
+        if self._last is not None and now - self._last[0] < self.min_interval_s:
+            return self.value
+        r = self._read()
+        if r is None:
+            self.value = os.getloadavg()[0] / (os.cpu_count() or 1)
+            return self.value
+        total, idle = r
+        if self._last is not None and total > self._last[1]:
+            dt, di = total - self._last[1], idle - self._last[2]
+            self.value = 1.0 - di / dt
+        self._last = (now, total, idle)
+        return self.value
+
+
+class Shadow:
+    def __init__(
+        self,
+        models: Dict[str, str],
+        sample: float = 0.05,
+        max_cpu: float = 0.8,
+        max_queue: int = 32,
+        iou: float = 0.5,
+    ):
+        self.models = models
+        self.sample_rate = sample
+        self.max_cpu = max_cpu
+        self.reports = {t: ShadowReport(t, mp, iou) for t, mp in models.items()}
+        self.mirrored = 0
+        self.dropped = 0  # queue full
+        self.skipped = 0  # machine busy
+        self._services: Dict[str, BaseService] = {}
+        self._cpu = _CpuMeter()
+        self._q: "queue.Queue[Tuple[str, Image.Image, Dict[str, Any], float]]" = (
+            queue.Queue(max_queue)
+        )
+        self._thread = threading.Thread(target=self._loop, name="shadow", daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------ request path
+
+    def sample(self, task: str) -> bool:
+        return task in self.models and random.random() < self.sample_rate
+
+    def mirror(
+        self, task: str, img: Image.Image, pred: Dict[str, Any], primary_ms: float
+    ) -> None:
+        """Non-blocking; the frame is dropped if the shadow queue is full."""
+        try:
+            self._q.put_nowait((task, img, pred, primary_ms))
+            self.mirrored += 1
+        except queue.Full:
+            self.dropped += 1
+
+    # ------------------------------------------------------------ shadow thread
+
+    def saturated(self) -> bool:
+        queued = sum(s["queued"] for s in get_scheduler().stats().values())
+        return queued > 0 or self._cpu.busy() > self.max_cpu
+
+    def _service(self, task: str) -> BaseService:
+        if task not in self._services:
+            self._services[task] = build_service(task, model_path=self.models[task])
+        return self._services[task]
+
+    def _loop(self) -> None:
+        try:  # per-thread nice on Linux; the candidate yields the CPU to serving
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            task, img, pred, primary_ms = self._q.get()
+            if self.saturated():
+                self.skipped += 1
+                continue
+            report = self.reports[task]
+            try:
+                svc = self._service(task)
+                x = svc.prepare(img)
+                t0 = time.perf_counter()
+                cand = svc.infer(x)
+                ms = (time.perf_counter() - t0) * 1000
+            except Exception as e:  # a broken candidate must not take serving down
+                report.errors += 1
+                print(f"[shadow] {task} candidate failed: {e}")
+                continue
+            report.add(pred, cand, primary_ms, ms)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample": self.sample_rate,
+            "max_cpu": self.max_cpu,
+            "cpu_busy": round(self._cpu.value, 3),
+            "mirrored": self.mirrored,
+            "dropped": self.dropped,
+            "skipped_busy": self.skipped,
+            "tasks": {t: r.snapshot() for t, r in self.reports.items()},
+        }
+
+
+@lru_cache(maxsize=1)
+def get_shadow() -> Optional[Shadow]:
+    models = {t: mp for t in TASKS if (mp := os.getenv(f"SHADOW_{t.upper()}_MODEL"))}
+    if not models:
+        return None
+    return Shadow(
+        models,
+        sample=float(os.getenv("SHADOW_SAMPLE", "0.05")),
+        max_cpu=float(os.getenv("SHADOW_MAX_CPU", "0.8")),
+        max_queue=int(os.getenv("SHADOW_QUEUE", "32")),
+        iou=float(os.getenv("SHADOW_IOU", "0.5")),
+    )
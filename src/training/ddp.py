@@ -0,0 +1,354 @@
+"""
+CPU data-parallel training: N local processes, torch.distributed (gloo).
+
+Each rank
+  - is pinned to its own slice of the cores (sched_setaffinity) with torch /
+    OpenMP threads sized to that slice, so ranks do not oversubscribe;
+  - builds the same ultralytics trainer as `train.fit` (mmap-cached dataset
+    when available) but drives the loop itself: a DistributedSampler shards
+    the training set, the model is wrapped in DistributedDataParallel and
+    gradients are only all-reduced on the micro-batch that steps the optimizer
+    (`no_sync` for the others);
+  - times every epoch; the slowest rank's time is the epoch time.
+Only rank 0 keeps the EMA, logs to W&B, validates and writes models/weights.pt
+and metrics.json (through `train.publish`).
+
+  python -m src.training.train --procs 4
+  python -m src.training.train --scaling 1,2,4,8      # epoch time / efficiency
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import socket
+import time
+from contextlib import contextmanager, nullcontext
+from copy import deepcopy
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+DEFAULT_PROJECT = "runs/ddp"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+THREAD_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def _cores() -> List[int]:
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+
+
+def _threads_per_rank(world: int) -> int:
+    return max(1, (len(_cores()) or os.cpu_count() or 1) // world)
+
+
+@contextmanager
+def _thread_env(world: int) -> Iterator[None]:
+    """
+    Size the OpenMP/BLAS pools for each rank in the parent's environment.
+    Spawned children inherit it at start() and re-import `__main__` (numpy,
+    possibly torch) before the target runs, so setting it in the child is too late.
+    """
+    saved = {v: os.environ.get(v) for v in THREAD_VARS}
+    os.environ.update({v: str(_threads_per_rank(world)) for v in THREAD_VARS})
+    try:
+        yield
+    finally:
+        for v, old in saved.items():
+            if old is None:
+                os.environ.pop(v, None)
+            else:
+                os.environ[v] = old
+
+
+def _partition(rank: int, world: int) -> int:
+    """Pin this rank to a disjoint core slice; returns its thread count."""
+    cores = _cores()
+    per = _threads_per_rank(world)
+    if cores and len(cores) >= world:
+        os.sched_setaffinity(0, cores[rank * per : (rank + 1) * per])
+    return per
+
+
+@contextmanager
+def _rank0_first(rank: int) -> Iterator[None]:
+    """Rank 0 runs the block first (downloads, label caches), the others after it."""
+    import torch.distributed as dist
+
+    if rank > 0:
+        dist.barrier()
+    yield
+    if rank == 0:
+        dist.barrier()
+
+
+def _rank_main(rank: int, world: int, port: int, job: Dict[str, Any]) -> None:
+    threads = _partition(rank, world)
+    import numpy as np
+    import torch
+    import torch.distributed as dist
+    from torch import nn
+    from torch.nn.parallel import DistributedDataParallel
+    from ultralytics.data import build_dataloader
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    from ultralytics.utils.torch_utils import ModelEMA
+
+    from .mmap_cache import cached_trainer_cls, load_index
+    from .train import DATA_ROOT, _wandb_run, publish
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    dist.init_process_group(
+        "gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world
+    )
+    p, epochs = job["params"], int(job["epochs"])
+    torch.manual_seed(int(p["seed"]) + rank)
+
+    index = load_index(DATA_ROOT)
+    trainer_cls = (
+        cached_trainer_cls(DATA_ROOT)
+        if index and int(index["imgsz"]) == int(p["imgsz"])
+        else DetectionTrainer
+    )
+    global_batch = int(p["batch"])
+    batch = max(1, global_batch // world)
+    with _rank0_first(rank):
+        trainer = trainer_cls(
+            overrides=dict(
+                model=p.get("model", "yolov8n.pt"),
+                data=str(DATA_ROOT / "data.yaml"),
+                epochs=epochs,
+                imgsz=int(p["imgsz"]),
+                batch=global_batch,
+                lr0=float(p["lr0"]),
+                seed=int(p["seed"]),
+                device="cpu",
+                project=job["project"],
+                name=job["name"],
+                exist_ok=True,
+                plots=False,
+                verbose=False,
+            )
+        )
+        trainer.setup_model()
+        trainer.set_model_attributes()
+        dataset = trainer.build_dataset(trainer.trainset, mode="train", batch=batch)
+    args = trainer.args
+    model = trainer.model
+    loader = build_dataloader(
+        dataset, batch, int(p.get("workers_per_rank", 2)), shuffle=True, rank=rank
+    )
+    ddp = DistributedDataParallel(model)
+
+    nb = len(loader)
+    accumulate = max(round(args.nbs / global_batch), 1)
+    decay = args.weight_decay * global_batch * accumulate / args.nbs
+    iterations = math.ceil(len(dataset) / max(global_batch, args.nbs)) * epochs
+    trainer.optimizer = trainer.build_optimizer(
+        model=model,
+        name=args.optimizer,
+        lr=args.lr0,
+        momentum=args.momentum,
+        decay=decay,
+        iterations=iterations,
+    )
+    trainer.epochs = epochs
+    trainer._setup_scheduler()  # pylint: disable=protected-access
+    opt = trainer.optimizer
+    ema = ModelEMA(model) if rank == 0 else None
+    run = _wandb_run(p) if rank == 0 and job["publish"] else None
+    nw = max(round(args.warmup_epochs * nb), 100) if args.warmup_epochs > 0 else -1
+
+    epoch_s: List[float] = []
+    last_opt_step = -1
+    for epoch in range(epochs):
+        loader.sampler.set_epoch(epoch)
+        model.train()
+        t0 = time.perf_counter()
+        tloss = torch.zeros(3)
+        for i, b in enumerate(loader):
+            ni = i + nb * epoch
+            if ni <= nw:  # same warmup ramp as ultralytics' BaseTrainer
+                xi = [0, nw]
+                accumulate = max(
+                    1, int(np.interp(ni, xi, [1, args.nbs / global_batch]).round())
+                )
+                for j, x in enumerate(opt.param_groups):
+                    x["lr"] = np.interp(
+                        ni,
+                        xi,
+                        [
+                            args.warmup_bias_lr if j == 0 else 0.0,
+                            x["initial_lr"] * trainer.lf(epoch),
+                        ],
+                    )
+                    if "momentum" in x:
+                        x["momentum"] = np.interp(
+                            ni, xi, [args.warmup_momentum, args.momentum]
+                        )
+            step = ni - last_opt_step >= accumulate or i == nb - 1
+            b = trainer.preprocess_batch(b)
+            with ddp.no_sync() if not step else nullcontext():
+                loss, items = ddp(b)
+                (loss * world).backward()  # DDP averages; match the global-batch sum
+            tloss = (tloss * i + items) / (i + 1)
+            if step:
+                nn.utils.clip_grad_norm_(model.parameters(), max_norm=10.0)
+                opt.step()
+                opt.zero_grad()
+                if ema is not None:
+                    ema.update(model)
+                last_opt_step = ni
+        trainer.scheduler.step()
+        dt = torch.tensor([time.perf_counter() - t0])
+        dist.all_reduce(dt, op=dist.ReduceOp.MAX)
+        dist.all_reduce(tloss)  # gloo has no AVG
+        tloss /= world
+        epoch_s.append(float(dt))
+        if rank == 0:
+            rec = {
+                "epoch": epoch + 1,
+                "epoch_s": epoch_s[-1],
+                "images_per_s": len(dataset) / epoch_s[-1],
+                **{
+                    f"train/{k}_loss": float(v)
+                    for k, v in zip(("box", "cls", "dfl"), tloss)
+                },
+            }
+            print(
+                f"[ddp] world={world} "
+                + " ".join(f"{k}={v:.4g}" for k, v in rec.items())
+            )
+            if run is not None:
+                run.log(rec)
+
+    dist.barrier()
+    dist.destroy_process_group()
+    if rank != 0:
+        return
+
+    last = Path(trainer.wdir) / "last.pt"
+    last.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(
+        {
+            "epoch": epochs - 1,
+            "model": None,
+            "ema": deepcopy(ema.ema).half(),
+            "updates": ema.updates,
+            "train_args": vars(args),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        last,
+    )
+    result: Dict[str, Any] = {
+        "world": world,
+        "threads_per_rank": threads,
+        "batch_per_rank": batch,
+        "images": len(dataset),
+        "epoch_s": epoch_s,
+        "weights": str(last),
+    }
+    if job["publish"]:
+        from ultralytics import YOLO
+
+        box = (
+            YOLO(str(last))
+            .val(
+                data=args.data,
+                imgsz=args.imgsz,
+                batch=global_batch,
+                device="cpu",
+                plots=False,
+                verbose=False,
+            )
+            .box
+        )
+        result["map50"] = float(box.map50)
+        publish(
+            last,
+            result["map50"],
+            run,
+            {"procs": world, "epoch_s": _steady(epoch_s)},
+        )
+    Path(job["result"]).write_text(json.dumps(result, indent=2))
+
+
+def _steady(epoch_s: List[float]) -> float:
+    """Mean epoch time, ignoring the first epoch when there are more (warm-up)."""
+    xs = epoch_s[1:] if len(epoch_s) > 1 else epoch_s
+    return sum(xs) / max(1, len(xs))
+
+
+def fit_ddp(
+    p: Dict[str, Any],
+    procs: int,
+    epochs: Optional[int] = None,
+    publish: bool = True,
+    name: str = "train",
+) -> Dict[str, Any]:
+    """Train on `procs` local ranks; returns rank 0's summary (epoch times, weights, map50)."""
+    out = Path(DEFAULT_PROJECT).resolve() / name
+    out.mkdir(parents=True, exist_ok=True)
+    job = {
+        "params": p,
+        "epochs": int(epochs or p["epochs"]),
+        "publish": publish,
+        "project": str(out.parent),
+        "name": name,
+        "result": str(out / "ddp.json"),
+    }
+    port = _free_port()
+    ctx = get_context("spawn")  # fresh interpreters: no torch thread pools yet
+    ranks = [
+        ctx.Process(target=_rank_main, args=(r, procs, port, job), name=f"ddp-rank{r}")
+        for r in range(procs)
+    ]
+    with _thread_env(procs):
+        for pr in ranks:
+            pr.start()
+    # a dead rank leaves the others blocked in a collective: stop them all
+    while any(pr.is_alive() for pr in ranks):
+        if any(pr.exitcode not in (None, 0) for pr in ranks):
+            for pr in ranks:
+                pr.terminate()
+            break
+        time.sleep(0.5)
+    for pr in ranks:
+        pr.join()
+    failed = [pr.name for pr in ranks if pr.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"DDP training failed on {', '.join(failed)}")
+    return json.loads(Path(job["result"]).read_text())
+
+
+def scaling(p: Dict[str, Any], procs: List[int], epochs: int) -> Dict[str, Any]:
+    """Epoch time and scaling efficiency vs process count (relative to the smallest count)."""
+    rows = []
+    for n in sorted(procs):
+        r = fit_ddp(p, n, epochs=epochs, publish=False, name=f"scale-{n}")
+        rows.append(
+            {
+                "procs": n,
+                "threads_per_rank": r["threads_per_rank"],
+                "epoch_s": _steady(r["epoch_s"]),
+                "images_per_s": r["images"] / _steady(r["epoch_s"]),
+            }
+        )
+    base = rows[0]
+    for r in rows:
+        r["speedup"] = base["epoch_s"] / r["epoch_s"]
+        r["efficiency"] = r["speedup"] / (r["procs"] / base["procs"])
+        print(
+            f"[ddp] procs={r['procs']:<3} epoch={r['epoch_s']:.2f}s "
+            f"{r['images_per_s']:.1f} img/s speedup={r['speedup']:.2f} "
+            f"efficiency={r['efficiency']:.0%}"
+        )
+    return {"epochs": epochs, "runs": rows}
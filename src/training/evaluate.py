@@ -0,0 +1,361 @@
+"""
+Offline evaluation of model variants: accuracy vs. latency vs. memory.
+
+Each variant (weights, input size, torch or exported runtime) is loaded through
+the serving `BaseService` interface in its own process, run over a labeled
+dataset, and scored:
+
+  det  mAP50 / mAP50-95       YOLO layout: <root>/images/**, <root>/labels/** (+ data.yaml names)
+  seg  mIoU (polygon masks)   same layout, YOLO segment labels
+  cls  top-1 / top-5          <root>/<class_name>/*.jpg
+
+together with p50/p99 per-call latency and peak RSS. Variants whose p99
+exceeds `latency_budget_ms[task]` fail the gate. The report is written as JSON
+(tagged with the git commit) so runs can be diffed across commits.
+
+  python -m src.training.evaluate                       # params.yaml: evaluate
+  python -m src.training.evaluate --candidate det-640   # exit 1 if it fails the gate
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import yaml
+from PIL import Image, ImageDraw
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+DEFAULTS: Dict[str, Any] = {
+    "out": "reports/eval.json",
+    "warmup": 3,
+    "max_images": 200,
+    "latency_budget_ms": {},
+    "datasets": {"det": "data/processed"},
+    "variants": [],
+}
+
+
+# ---------------------------------------------------------------- datasets
+
+
+def _names(root: Path) -> Dict[int, str]:
+    f = root / "data.yaml"
+    if f.exists():
+        names = (yaml.safe_load(f.read_text()) or {}).get("names") or {}
+        if isinstance(names, list):
+            names = dict(enumerate(names))
+        return {int(k): str(v) for k, v in names.items()}
+    return {}
+
+
+def _yolo_items(
+    root: Path, limit: int, include: Optional[Set[Path]] = None
+) -> List[Tuple[Path, Path]]:
+    imgs = sorted(
+        f
+        for f in (root / "images").rglob("*")
+        if f.suffix.lower() in IMG_EXTS and (include is None or f.resolve() in include)
+    )
+    items = []
+    for f in imgs[: limit or None]:
+        rel = f.relative_to(root / "images")
+        items.append((f, (root / "labels" / rel).with_suffix(".txt")))
+    return items
+
+
+def _read_labels(path: Path) -> List[List[float]]:
+    if not path.exists():
+        return []
+    return [list(map(float, ln.split())) for ln in path.read_text().splitlines() if ln.strip()]
+
+
+# ---------------------------------------------------------------- metrics
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of (N,4) and (M,4) xyxy boxes."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(-1)
+    area_a = (a[:, 2:] - a[:, :2]).prod(-1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(-1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def _ap(tp: np.ndarray, conf: np.ndarray, npos: int) -> float:
+    """101-point interpolated AP (COCO / ultralytics convention)."""
+    if npos == 0:
+        return float("nan")
+    if len(tp) == 0:
+        return 0.0
+    order = np.argsort(-conf)
+    tpc = np.cumsum(tp[order])
+    fpc = np.cumsum(1 - tp[order])
+    recall = tpc / npos
+    precision = tpc / (tpc + fpc)
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return float(np.trapz(np.interp(x, mrec, mpre), x))
+
+
+def detection_map(
+    preds: List[List[Dict[str, Any]]], gts: List[List[Tuple[str, List[float]]]]
+) -> Dict[str, float]:
+    """preds/gts per image; preds are service bboxes, gts are (cls_name, xyxy)."""
+    classes = sorted({c for g in gts for c, _ in g})
+    aps = np.full((len(classes), len(IOU_THRESHOLDS)), np.nan)
+    for ci, name in enumerate(classes):
+        tps: List[np.ndarray] = []
+        confs: List[float] = []
+        npos = 0
+        for p_img, g_img in zip(preds, gts):
+            g = np.array([b for c, b in g_img if c == name]).reshape(-1, 4)
+            p = [b for b in p_img if b["cls"] == name]
+            npos += len(g)
+            if not p:
+                continue
+            p.sort(key=lambda b: -b["conf"])
+            pb = np.array([[b["x1"], b["y1"], b["x2"], b["y2"]] for b in p])
+            iou = box_iou(pb, g)
+            tp = np.zeros((len(p), len(IOU_THRESHOLDS)))
+            for ti, thr in enumerate(IOU_THRESHOLDS):
+                taken = np.zeros(len(g), dtype=bool)
+                for i in range(len(p)):
+                    if len(g) == 0:
+                        break
+                    cand = np.where(~taken & (iou[i] >= thr))[0]
+                    if len(cand):
+                        j = cand[np.argmax(iou[i, cand])]
+                        taken[j] = True
+                        tp[i, ti] = 1
+            tps.append(tp)
+            confs.extend(b["conf"] for b in p)
+        tp_all = np.concatenate(tps) if tps else np.zeros((0, len(IOU_THRESHOLDS)))
+        conf_all = np.array(confs)
+        for ti in range(len(IOU_THRESHOLDS)):
+            aps[ci, ti] = _ap(tp_all[:, ti], conf_all, npos)
+    if not classes:
+        return {"map50": 0.0, "map50_95": 0.0}
+    return {
+        "map50": float(np.nanmean(aps[:, 0])),
+        "map50_95": float(np.nanmean(aps)),
+        "per_class_ap50": {c: float(a) for c, a in zip(classes, aps[:, 0])},
+    }
+
+
+def _raster(polys: List[List[List[float]]], size: Tuple[int, int]) -> np.ndarray:
+    m = Image.new("L", size, 0)
+    d = ImageDraw.Draw(m)
+    for pts in polys:
+        if len(pts) >= 3:
+            d.polygon([tuple(p) for p in pts], fill=1)
+    return np.asarray(m, dtype=bool)
+
+
+# ---------------------------------------------------------------- runner
+
+
+def _stats(lat: List[float]) -> Dict[str, float]:
+    a = np.asarray(lat) if lat else np.zeros(1)
+    return {
+        "p50_ms": float(np.percentile(a, 50)),
+        "p99_ms": float(np.percentile(a, 99)),
+        "mean_ms": float(a.mean()),
+        "n": len(lat),
+    }
+
+
+def _timed(svc, img: Image.Image, lat: List[float]) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    out = svc.predict(img)
+    lat.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def evaluate_variant(
+    v: Dict[str, Any],
+    dataset: str,
+    warmup: int,
+    max_images: int,
+    include: Optional[Set[Path]] = None,
+) -> Dict[str, Any]:
+    """
+    Runs in a fresh process so peak RSS is attributable to this variant.
+    `include` (resolved image paths) restricts the dataset to a subset.
+    """
+    from src.serving.inference import build_service
+
+    root = Path(dataset)
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    kwargs = {k: v[k] for k in ("model_path", "imgsz", "conf", "iou", "native") if k in v}
+    t0 = time.perf_counter()
+    svc = build_service(v["task"], **kwargs)
+    load_s = time.perf_counter() - t0
+    lat: List[float] = []
+    metrics: Dict[str, Any]
+
+    if v["task"] == "cls":
+        files = sorted(
+            (f, f.parent.name)
+            for f in root.rglob("*")
+            if f.suffix.lower() in IMG_EXTS
+            and f.parent != root
+            and (include is None or f.resolve() in include)
+        )[: max_images or None]
+        if files:
+            for _ in range(warmup):
+                svc.predict(Image.open(files[0][0]).convert("RGB"))
+        top1 = top5 = 0
+        for f, label in files:
+            topk = [c for c, _ in _timed(svc, Image.open(f).convert("RGB"), lat)["topk"]]
+            top1 += bool(topk[:1] == [label])
+            top5 += label in topk[:5]
+        n = max(1, len(files))
+        metrics = {"top1": top1 / n, "top5": top5 / n}
+    else:
+        names = _names(root)
+        items = _yolo_items(root, max_images, include)
+        if items:
+            for _ in range(warmup):
+                svc.predict(Image.open(items[0][0]).convert("RGB"))
+        preds, gts = [], []
+        inter: Dict[str, int] = {}
+        union: Dict[str, int] = {}
+        for img_path, lbl_path in items:
+            img = Image.open(img_path).convert("RGB")
+            w, h = img.size
+            out = _timed(svc, img, lat)
+            rows = _read_labels(lbl_path)
+            if v["task"] == "det":
+                g = []
+                for r in rows:
+                    c, cx, cy, bw, bh = r[:5]
+                    g.append(
+                        (
+                            names.get(int(c), str(int(c))),
+                            [(cx - bw / 2) * w, (cy - bh / 2) * h, (cx + bw / 2) * w, (cy + bh / 2) * h],
+                        )
+                    )
+                preds.append(out["bboxes"])
+                gts.append(g)
+            else:
+                gt_polys: Dict[str, list] = {}
+                for r in rows:
+                    pts = np.asarray(r[1:]).reshape(-1, 2) * (w, h)
+                    gt_polys.setdefault(names.get(int(r[0]), str(int(r[0]))), []).append(pts.tolist())
+                pr_polys: Dict[str, list] = {}
+                for m in out["masks"]:
+                    pr_polys.setdefault(m["cls"], []).append(m["points"])
+                for c in gt_polys:
+                    gm = _raster(gt_polys[c], (w, h))
+                    pm = _raster(pr_polys.get(c, []), (w, h))
+                    inter[c] = inter.get(c, 0) + int((gm & pm).sum())
+                    union[c] = union.get(c, 0) + int((gm | pm).sum())
+        if v["task"] == "det":
+            metrics = detection_map(preds, gts)
+        else:
+            ious = {c: inter[c] / union[c] for c in union if union[c]}
+            metrics = {"miou": float(np.mean(list(ious.values()))) if ious else 0.0, "per_class_iou": ious}
+
+    rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        **v,
+        "model_version": svc.model_version,
+        "metrics": metrics,
+        "latency": _stats(lat),
+        "load_s": load_s,
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": rss1 / 1024,
+        "model_rss_mb": (rss1 - rss0) / 1024,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(cfg: Dict[str, Any], only: Optional[List[str]] = None) -> Dict[str, Any]:
+    results = []
+    ctx = get_context("spawn")
+    for v in cfg["variants"]:
+        if only and v["name"] not in only:
+            continue
+        dataset = v.get("dataset") or cfg["datasets"].get(v["task"])
+        if not dataset:
+            print(f"[eval] skip {v['name']}: no dataset for task {v['task']}")
+            continue
+        print(f"[eval] {v['name']} ({v['task']}, {v.get('model_path')}, imgsz={v.get('imgsz')})")
+        try:
+            with ProcessPoolExecutor(1, mp_context=ctx) as ex:
+                r = ex.submit(
+                    evaluate_variant, v, dataset, int(cfg["warmup"]), int(cfg["max_images"])
+                ).result()
+        except Exception as e:  # missing weights / runtime must not hide the other variants
+            print(f"[eval] {v['name']} failed: {e}")
+            results.append({**v, "error": str(e), "passed": False})
+            continue
+        budget = (cfg.get("latency_budget_ms") or {}).get(v["task"])
+        r["budget_ms"] = budget
+        r["passed"] = budget is None or r["latency"]["p99_ms"] <= float(budget)
+        results.append(r)
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "variants": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--params", default="params.yaml")
+    ap.add_argument("--only", nargs="*", help="variant names to run")
+    ap.add_argument("--out")
+    ap.add_argument("--candidate", help="exit non-zero unless this variant passes the latency gate")
+    a = ap.parse_args(argv)
+
+    cfg = {**DEFAULTS, **((yaml.safe_load(open(a.params)) or {}).get("evaluate") or {})}
+    report = run(cfg, a.only)
+    out = Path(a.out or cfg["out"])
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+
+    for r in report["variants"]:
+        if "error" in r:
+            print(f"[FAIL] {r['name']:<20} error: {r['error']}")
+            continue
+        m = {k: round(v, 4) for k, v in r["metrics"].items() if isinstance(v, float)}
+        lat = r["latency"]
+        flag = "ok " if r["passed"] else "FAIL"
+        print(
+            f"[{flag}] {r['name']:<20} {m} p50={lat['p50_ms']:.1f}ms "
+            f"p99={lat['p99_ms']:.1f}ms rss={r['peak_rss_mb']:.0f}MB"
+        )
+    print(f"report -> {out}")
+    if a.candidate:
+        hit = [r for r in report["variants"] if r["name"] == a.candidate]
+        if not hit or not hit[0]["passed"]:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
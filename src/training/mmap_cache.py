@@ -0,0 +1,197 @@
+"""
+Memory-mapped, pre-resized image cache for the processed dataset.
+
+Layout (under <dataset>/cache):
+  images.u8   uint8 memmap of shape (N, S, S, 3), BGR, each row holds one image
+              resized so its long side is S (top-left aligned, rest is padding)
+  index.json  {"imgsz": S, "n": N, "items": {relpath: [row, h0, w0, h, w, key]}}
+
+Rows are stable across rebuilds: new images take rows freed by removed ones or
+grow the file by appending rows, so adding data never rewrites the cache.
+
+Each row also records the manifest key (content hash) of the JPEG it was built
+from; `MmapImages.get` treats a row whose key no longer matches the manifest as
+a miss, so a stale cache can never pair old pixels with new labels.
+
+The cache mirrors what ultralytics' `YOLODataset.load_image` produces, so
+`CachedDetectionTrainer` can serve training images straight from the memmap
+instead of re-decoding JPEGs every epoch.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+CACHE_DIR = "cache"
+DATA_FILE = "images.u8"
+INDEX_FILE = "index.json"
+
+_MM: Optional[np.memmap] = None  # per-process writer handle (pool initializer)
+
+
+def _paths(root: Path) -> Tuple[Path, Path]:
+    d = root / CACHE_DIR
+    return d / DATA_FILE, d / INDEX_FILE
+
+
+def load_index(root: Path) -> Optional[Dict[str, Any]]:
+    _, idx = _paths(root)
+    if not idx.exists():
+        return None
+    return json.loads(idx.read_text())
+
+
+def save_index(root: Path, index: Dict[str, Any]) -> None:
+    _, idx = _paths(root)
+    tmp = idx.with_suffix(".tmp")
+    tmp.write_text(json.dumps(index))
+    os.replace(tmp, idx)
+
+
+def manifest_keys(root: Path) -> Dict[str, str]:
+    """{"images/<shard>/<id>.jpg": key} from prepare_data's per-shard manifest."""
+    keys: Dict[str, str] = {}
+    for f in sorted((root / "manifest").glob("*.json")):
+        for item_id, e in json.loads(f.read_text()).items():
+            keys[os.path.join("images", e["shard"], f"{item_id}.jpg")] = e["key"]
+    return keys
+
+
+def open_writer(root: Path, n: int, imgsz: int, fresh: bool) -> None:
+    """Create (fresh=True) or reopen the memmap for writing in this process, growing it to `n` rows."""
+    global _MM
+    data, _ = _paths(root)
+    data.parent.mkdir(parents=True, exist_ok=True)
+    mode = "w+" if fresh or not data.exists() else "r+"
+    if mode == "r+" and data.stat().st_size < n * imgsz * imgsz * 3:
+        os.truncate(data, n * imgsz * imgsz * 3)  # append zeroed rows
+    _MM = np.memmap(data, dtype=np.uint8, mode=mode, shape=(n, imgsz, imgsz, 3))
+
+
+def init_worker(root: str, n: int, imgsz: int) -> None:
+    open_writer(Path(root), n, imgsz, fresh=False)
+
+
+def write_row(row: int, image_path: str, imgsz: int) -> Tuple[int, int, int, int]:
+    """Resize one image into cache row `row`; returns (h0, w0, h, w)."""
+    assert _MM is not None, "open_writer() not called in this process"
+    with Image.open(image_path) as im:
+        im = im.convert("RGB")
+        w0, h0 = im.size
+        r = imgsz / max(h0, w0)
+        w, h = min(imgsz, round(w0 * r)), min(imgsz, round(h0 * r))
+        if (w, h) != (w0, h0):
+            im = im.resize((w, h), Image.BILINEAR)
+        arr = np.asarray(im)[..., ::-1]  # RGB -> BGR (cv2 order)
+    _MM[row, :h, :w] = arr
+    return h0, w0, h, w
+
+
+def flush() -> None:
+    if _MM is not None:
+        _MM.flush()
+
+
+class MmapImages:
+    """Read-only view over the cache; opened lazily so it survives pickling into dataloader workers."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root).resolve()
+        index = load_index(self.root)
+        if index is None:
+            raise FileNotFoundError(f"no image cache under {self.root / CACHE_DIR}")
+        self.imgsz = int(index["imgsz"])
+        self.n = int(index["n"])
+        self.items: Dict[str, list] = index["items"]
+        self.keys = manifest_keys(self.root)
+        self._mm: Optional[np.memmap] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_mm"] = None
+        return state
+
+    def _data(self) -> np.memmap:
+        if self._mm is None:
+            data, _ = _paths(self.root)
+            self._mm = np.memmap(
+                data, dtype=np.uint8, mode="r", shape=(self.n, self.imgsz, self.imgsz, 3)
+            )
+        return self._mm
+
+    def get(self, image_path: str):
+        """Returns (bgr_array, (h0, w0), (h, w)) or None when the image is not cached (or stale)."""
+        rel = os.path.relpath(Path(image_path).resolve(), self.root)
+        meta = self.items.get(rel)
+        if meta is None or self.keys.get(rel) != meta[5]:
+            return None
+        row, h0, w0, h, w = meta[:5]
+        return np.array(self._data()[row, :h, :w]), (h0, w0), (h, w)
+
+
+def _cached_dataset_cls():
+    from ultralytics.data import YOLODataset
+
+    class CachedYOLODataset(YOLODataset):
+        def __init__(self, *args, mmap_root: str, **kwargs):
+            self.mmap = MmapImages(mmap_root)
+            super().__init__(*args, **kwargs)
+
+        def load_image(self, i, rect_mode=True):
+            if self.ims[i] is not None or not rect_mode or self.imgsz != self.mmap.imgsz:
+                return super().load_image(i, rect_mode)
+            hit = self.mmap.get(self.im_files[i])
+            if hit is None:
+                return super().load_image(i, rect_mode)
+            # same buffer bookkeeping as BaseDataset.load_image: Mosaic samples from it
+            if self.augment:
+                self.ims[i], self.im_hw0[i], self.im_hw[i] = hit
+                self.buffer.append(i)
+                if len(self.buffer) >= self.max_buffer_length:
+                    j = self.buffer.pop(0)
+                    if self.cache != "ram":
+                        self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+            return hit
+
+    return CachedYOLODataset
+
+
+def cached_trainer_cls(mmap_root: str | Path):
+    """Build a DetectionTrainer subclass whose datasets read from the memmap cache."""
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    from ultralytics.utils import colorstr
+    from ultralytics.utils.torch_utils import de_parallel
+
+    dataset_cls = _cached_dataset_cls()
+    root = str(Path(mmap_root).resolve())
+
+    class CachedDetectionTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            gs = max(int(de_parallel(self.model).stride.max() if self.model else 0), 32)
+            cfg = self.args
+            return dataset_cls(
+                img_path=img_path,
+                imgsz=cfg.imgsz,
+                batch_size=batch,
+                augment=mode == "train",
+                hyp=cfg,
+                rect=cfg.rect or mode == "val",
+                cache=None,
+                single_cls=cfg.single_cls or False,
+                stride=gs,
+                pad=0.0 if mode == "train" else 0.5,
+                prefix=colorstr(f"{mode}: "),
+                task=cfg.task,
+                classes=cfg.classes,
+                data=self.data,
+                fraction=cfg.fraction if mode == "train" else 1.0,
+                mmap_root=root,
+            )
+
+    return CachedDetectionTrainer
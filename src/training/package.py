@@ -1,6 +1,13 @@
-from pathlib import Path, shutil
+from pathlib import Path
+
+from src.artifacts.store import ArtifactStore
 
 src = Path("models/weights.pt")
 dst = Path("models/serving")
-dst.mkdir(parents=True, exist_ok=True)
-shutil.copy2(src, dst / "model.pt") if src.exists() else print("no weights")
+if src.exists():
+    store = ArtifactStore.default("models")
+    sha = store.put(src, "model.pt")
+    store.materialize(store.object_path(sha), dst / "model.pt")
+    print(f"published model.pt sha256={sha}")
+else:
+    print("no weights")
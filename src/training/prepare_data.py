@@ -1,26 +1,378 @@
+"""
+Dataset builder for data/processed.
+
+Generates synthetic PPE scenes (or converts a folder of images + YOLO labels)
+into sharded `images/<shard>/` and `labels/<shard>/` directories using a
+process pool. Every item is keyed by a content hash and recorded in a
+per-shard manifest, so re-runs only rebuild what changed; converted files keep
+their id (and shard) when others are added or removed. Optionally builds a
+memory-mapped pre-resized image cache (see `mmap_cache.py`).
+
+  python -m src.training.prepare_data                      # params.yaml: prepare
+  python -m src.training.prepare_data --num-images 100000 --workers 16 --cache
+  python -m src.training.prepare_data --source /data/raw   # convert a folder
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
 import random
+from multiprocessing import Pool
 from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import yaml
 from PIL import Image, ImageDraw
 
-out = Path("data/processed")
-(out / "images").mkdir(parents=True, exist_ok=True)
-(out / "labels").mkdir(parents=True, exist_ok=True)
-with open(out / "data.yaml", "w") as f:
-    yaml.safe_dump(
-        {
-            "path": str(out.resolve()),
-            "train": "images",
-            "val": "images",
-            "names": {0: "person", 1: "helmet", 2: "vest"},
-        },
-        f,
+from . import mmap_cache
+
+GENERATOR_VERSION = 2  # bump when synthetic rendering changes to invalidate manifests
+NAMES = {0: "person", 1: "helmet", 2: "vest"}
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+DEFAULTS: Dict[str, Any] = {
+    "out": "data/processed",
+    "source": None,
+    "num_images": 10,
+    "width": 640,
+    "height": 480,
+    "shard_size": 1000,
+    "workers": 0,
+    "seed": 42,
+    "cache": False,
+    "cache_imgsz": 640,
+}
+
+
+def _sha256_bytes(b: bytes) -> str:
+    return hashlib.sha256(b).hexdigest()
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _shard(i: int, shard_size: int) -> str:
+    return f"{i // shard_size:05d}"
+
+
+# ---------------------------------------------------------------- planning
+
+
+def _plan_synthetic(p: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    for i in range(int(p["num_images"])):
+        spec = {
+            "kind": "synthetic",
+            "v": GENERATOR_VERSION,
+            "seed": int(p["seed"]),
+            "i": i,
+            "w": int(p["width"]),
+            "h": int(p["height"]),
+        }
+        yield {
+            "id": f"img_{i:07d}",
+            "shard": _shard(i, int(p["shard_size"])),
+            "spec": spec,
+            "key": _sha256_bytes(json.dumps(spec, sort_keys=True).encode()),
+        }
+
+
+def _source_label(img: Path, src_root: Path) -> Optional[Path]:
+    # YOLO layout (<root>/images/x.jpg -> <root>/labels/x.txt) or a sidecar x.txt
+    rel = img.relative_to(src_root)
+    if rel.parts and rel.parts[0] == "images":
+        cand = src_root / "labels" / Path(*rel.parts[1:]).with_suffix(".txt")
+        if cand.exists():
+            return cand
+    side = img.with_suffix(".txt")
+    return side if side.exists() else None
+
+
+def _source_ids(
+    src_root: Path, files: List[Path], old: Dict[str, Dict[str, Any]]
+) -> Dict[Path, int]:
+    """
+    Stable numeric id per source file, keyed by its path relative to the source
+    root: files seen before keep their id, new ones get the next free numbers,
+    so adding or removing a file never renumbers (or re-shards) the others.
+    """
+    seen = {
+        os.path.relpath(e["src"], src_root): int(item_id[4:])
+        for item_id, e in old.items()
+        if item_id.startswith("src_") and e.get("src")
+    }
+    ids: Dict[Path, int] = {}
+    nxt = max(seen.values(), default=-1) + 1
+    for f in files:
+        rel = os.path.relpath(f, src_root)
+        if rel in seen:
+            ids[f] = seen[rel]
+        else:
+            ids[f], nxt = nxt, nxt + 1
+    return ids
+
+
+def _plan_convert(
+    p: Dict[str, Any], old: Dict[str, Dict[str, Any]]
+) -> Iterator[Dict[str, Any]]:
+    src_root = Path(p["source"]).resolve()
+    files = sorted(
+        f for f in src_root.rglob("*") if f.suffix.lower() in IMG_EXTS and f.is_file()
     )
-for i in range(10):
-    w, h = 640, 480
-    img = Image.new("RGB", (w, h), (20, 20, 20))
+    ids = _source_ids(src_root, files, old)
+    for f in files:
+        i = ids[f]
+        label = _source_label(f, src_root)
+        stat = [
+            f.stat().st_size,
+            f.stat().st_mtime_ns,
+            label.stat().st_mtime_ns if label else 0,
+        ]
+        item_id = f"src_{i:07d}"
+        prev = old.get(item_id)
+        # stat unchanged -> reuse the previous content hash instead of re-reading the file
+        if prev and prev.get("src") == str(f) and prev.get("stat") == stat:
+            key = prev["key"]
+        else:
+            h = hashlib.sha256(_sha256_file(f).encode())
+            if label:
+                h.update(label.read_bytes())
+            key = h.hexdigest()
+        yield {
+            "id": item_id,
+            "shard": _shard(i, int(p["shard_size"])),
+            "spec": {"kind": "convert", "src": str(f), "label": str(label or "")},
+            "src": str(f),
+            "stat": stat,
+            "key": key,
+        }
+
+
+# ---------------------------------------------------------------- building
+
+
+def _render_synthetic(spec: Dict[str, Any]) -> Tuple[Image.Image, List[str]]:
+    rng = random.Random(spec["seed"] * 1_000_003 + spec["i"])
+    w, h = spec["w"], spec["h"]
+    bg = tuple(rng.randint(10, 90) for _ in range(3))
+    img = Image.new("RGB", (w, h), bg)
     d = ImageDraw.Draw(img)
-    d.rectangle([200, 120, 380, 360], outline=(200, 200, 200), width=3)
-    img.save(out / "images" / f"img_{i:04d}.jpg", quality=90)
-print("data ready")
+    rows: List[str] = []
+
+    def box(k: int, x1: float, y1: float, x2: float, y2: float) -> None:
+        cx, cy = (x1 + x2) / 2 / w, (y1 + y2) / 2 / h
+        rows.append(f"{k} {cx:.6f} {cy:.6f} {(x2 - x1) / w:.6f} {(y2 - y1) / h:.6f}")
+
+    for _ in range(rng.randint(1, 4)):
+        pw = rng.uniform(0.08, 0.22) * w
+        ph = pw * rng.uniform(1.8, 2.6)
+        x1 = rng.uniform(0, w - pw)
+        y1 = rng.uniform(0, max(1.0, h - ph))
+        x2, y2 = x1 + pw, min(h - 1.0, y1 + ph)
+        skin = (rng.randint(150, 230), rng.randint(110, 190), rng.randint(90, 160))
+        head = pw * 0.45
+        hx1, hy1 = x1 + (pw - head) / 2, y1
+        d.rectangle([x1, y1 + head, x2, y2], fill=(60, 60, 120))
+        d.ellipse([hx1, hy1, hx1 + head, hy1 + head], fill=skin)
+        box(0, x1, y1, x2, y2)
+        if rng.random() < 0.6:
+            hh = head * 0.5
+            d.chord([hx1 - 2, hy1 - 2, hx1 + head + 2, hy1 + hh * 2], 180, 360, fill=(240, 200, 0))
+            box(1, hx1 - 2, hy1 - 2, hx1 + head + 2, hy1 + hh)
+        if rng.random() < 0.6:
+            vy1, vy2 = y1 + head * 1.2, y1 + head + (y2 - y1 - head) * 0.5
+            d.rectangle([x1 + 2, vy1, x2 - 2, vy2], fill=(255, 120, 0))
+            box(2, x1 + 2, vy1, x2 - 2, vy2)
+    return img, rows
+
+
+def _build_item(job: Tuple[str, Dict[str, Any]]) -> Dict[str, Any]:
+    out, item = job
+    root = Path(out)
+    img_path = root / "images" / item["shard"] / f"{item['id']}.jpg"
+    lbl_path = root / "labels" / item["shard"] / f"{item['id']}.txt"
+    img_path.parent.mkdir(parents=True, exist_ok=True)
+    lbl_path.parent.mkdir(parents=True, exist_ok=True)
+
+    spec = item["spec"]
+    if spec["kind"] == "synthetic":
+        img, rows = _render_synthetic(spec)
+        label = "\n".join(rows) + ("\n" if rows else "")
+    else:
+        with Image.open(spec["src"]) as im:
+            img = im.convert("RGB")
+        label = Path(spec["label"]).read_text() if spec["label"] else ""
+
+    tmp = img_path.with_suffix(".tmp.jpg")
+    img.save(tmp, quality=90)
+    os.replace(tmp, img_path)
+    lbl_path.write_text(label)
+    entry = {k: item[k] for k in ("key", "src", "stat") if k in item}
+    entry["shard"] = item["shard"]
+    return {"id": item["id"], **entry}
+
+
+def _cache_item(job: Tuple[str, int, str, int, str]) -> Tuple[str, List[Any]]:
+    root, row, rel, imgsz, key = job
+    return rel, [row, *mmap_cache.write_row(row, os.path.join(root, rel), imgsz), key]
+
+
+# ---------------------------------------------------------------- manifest
+
+
+def _load_manifest(root: Path) -> Dict[str, Dict[str, Any]]:
+    entries: Dict[str, Dict[str, Any]] = {}
+    for f in sorted((root / "manifest").glob("*.json")):
+        entries.update(json.loads(f.read_text()))
+    return entries
+
+
+def _save_manifest(root: Path, entries: Dict[str, Dict[str, Any]]) -> None:
+    d = root / "manifest"
+    d.mkdir(parents=True, exist_ok=True)
+    by_shard: Dict[str, Dict[str, Any]] = {}
+    for item_id, e in entries.items():
+        by_shard.setdefault(e["shard"], {})[item_id] = e
+    for shard, items in by_shard.items():
+        tmp = d / f"{shard}.json.tmp"
+        tmp.write_text(json.dumps(items, sort_keys=True))
+        os.replace(tmp, d / f"{shard}.json")
+    for f in d.glob("*.json"):
+        if f.stem not in by_shard:
+            f.unlink()
+
+
+def _remove(root: Path, item_id: str, shard: str) -> None:
+    (root / "images" / shard / f"{item_id}.jpg").unlink(missing_ok=True)
+    (root / "labels" / shard / f"{item_id}.txt").unlink(missing_ok=True)
+
+
+def _write_data_yaml(root: Path) -> None:
+    with open(root / "data.yaml", "w") as f:
+        yaml.safe_dump(
+            {"path": str(root.resolve()), "train": "images", "val": "images", "names": NAMES},
+            f,
+        )
+
+
+# ---------------------------------------------------------------- driver
+
+
+def build_cache(root: Path, manifest: Dict[str, Dict[str, Any]], imgsz: int, workers: int) -> int:
+    rels = sorted(
+        os.path.join("images", e["shard"], f"{item_id}.jpg") for item_id, e in manifest.items()
+    )
+    old = mmap_cache.load_index(root)
+    fresh = old is None or int(old["imgsz"]) != imgsz
+    keys = {
+        os.path.join("images", e["shard"], f"{item_id}.jpg"): e["key"]
+        for item_id, e in manifest.items()
+    }
+    # rows are stable: unchanged images stay put, changed ones are rewritten in
+    # place, new ones reuse rows of removed images or are appended at the end
+    items: Dict[str, List[Any]] = (
+        {} if fresh else {r: m for r, m in old["items"].items() if r in keys}
+    )
+    n = 0 if fresh else int(old["n"])
+    free = iter(sorted(set(range(n)) - {m[0] for m in items.values()}))
+    todo = []
+    for r in rels:
+        meta = items.get(r)
+        if meta is not None and meta[5] == keys[r]:
+            continue
+        row = meta[0] if meta is not None else next(free, None)
+        if row is None:
+            row, n = n, n + 1
+        todo.append((str(root), row, r, imgsz, keys[r]))
+    n = max(1, n)
+    mmap_cache.open_writer(root, n, imgsz, fresh=fresh)
+    if todo:
+        with Pool(
+            workers,
+            initializer=mmap_cache.init_worker,
+            initargs=(str(root), n, imgsz),
+        ) as pool:
+            for rel, meta in pool.imap_unordered(_cache_item, todo, chunksize=64):
+                items[rel] = meta
+    mmap_cache.flush()
+    mmap_cache.save_index(root, {"imgsz": imgsz, "n": n, "items": items})
+    return len(todo)
+
+
+def build(p: Dict[str, Any]) -> Dict[str, int]:
+    root = Path(p["out"]).resolve()
+    root.mkdir(parents=True, exist_ok=True)
+    workers = int(p["workers"]) or os.cpu_count() or 1
+
+    old = _load_manifest(root)
+    plan = list(_plan_convert(p, old) if p.get("source") else _plan_synthetic(p))
+    wanted = {it["id"] for it in plan}
+
+    todo = []
+    for it in plan:
+        prev = old.get(it["id"])
+        present = (root / "images" / it["shard"] / f"{it['id']}.jpg").exists()
+        if prev and prev["key"] == it["key"] and prev["shard"] == it["shard"] and present:
+            continue
+        if prev and prev["shard"] != it["shard"]:
+            _remove(root, it["id"], prev["shard"])
+        todo.append((str(root), it))
+
+    stale = [(i, e["shard"]) for i, e in old.items() if i not in wanted]
+    for item_id, shard in stale:
+        _remove(root, item_id, shard)
+
+    manifest = {i: e for i, e in old.items() if i in wanted}
+    if todo:
+        with Pool(workers) as pool:
+            for entry in pool.imap_unordered(_build_item, todo, chunksize=32):
+                item_id = entry.pop("id")
+                manifest[item_id] = entry
+    _save_manifest(root, manifest)
+    _write_data_yaml(root)
+
+    stats = {"total": len(plan), "built": len(todo), "skipped": len(plan) - len(todo), "removed": len(stale)}
+    if p.get("cache"):
+        stats["cached"] = build_cache(root, manifest, int(p["cache_imgsz"]), workers)
+    elif (todo or stale) and (index := mmap_cache.load_index(root)) is not None:
+        # an existing cache would otherwise keep serving the old pixels
+        stats["cached"] = build_cache(root, manifest, int(index["imgsz"]), workers)
+    return stats
+
+
+def load_params(path: str = "params.yaml") -> Dict[str, Any]:
+    p = dict(DEFAULTS)
+    if Path(path).exists():
+        p.update((yaml.safe_load(open(path)) or {}).get("prepare") or {})
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--params", default="params.yaml")
+    ap.add_argument("--out")
+    ap.add_argument("--source", help="folder of images (+ YOLO labels) to convert")
+    ap.add_argument("--num-images", type=int)
+    ap.add_argument("--shard-size", type=int)
+    ap.add_argument("--workers", type=int, help="0 = all cores")
+    ap.add_argument("--cache", action="store_true", default=None, help="build the mmap image cache")
+    ap.add_argument("--cache-imgsz", type=int)
+    a = ap.parse_args(argv)
+
+    p = load_params(a.params)
+    for k, v in vars(a).items():
+        if k != "params" and v is not None:
+            p[k] = v
+    stats = build(p)
+    print("data ready", json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
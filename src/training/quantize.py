@@ -0,0 +1,303 @@
+"""
+Static INT8 post-training quantization of the det/seg/cls models.
+
+For each task in params.yaml `quantize.tasks`:
+  1. export the fp32 weights to ONNX (ultralytics exporter, fixed imgsz),
+  2. calibrate a static INT8 QDQ model with onnxruntime on images from
+     `calib_dir` (data/processed/images by default, any folder works),
+     keeping the last (post-processing) head module in float; the model is
+     written to `work_dir`, never next to the served weights,
+  3. evaluate fp32 and INT8 on the held-out set through `evaluate.py`,
+  4. publish `<stem>.int8.onnx` into the artifact store and MODELS_DIR only
+     if the metric drop is within `tolerance`.
+
+Calibration and holdout images must not overlap, or the guard measures the
+INT8 model on the data its ranges were fitted to. When `calib_dir` and the
+holdout share images, those are split by a hash of the file name:
+`holdout_fraction` of them are evaluated, the rest calibrate.
+
+Serving picks the quantized file with DET_MODEL_VARIANT=int8 (SEG_/CLS_ likewise).
+
+  python -m src.training.quantize
+  python -m src.training.quantize --tasks det --calib-dir /data/site_images
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import yaml
+from PIL import Image
+
+from src.artifacts.store import ArtifactStore
+
+from .evaluate import IMG_EXTS, evaluate_variant
+
+DEFAULTS: Dict[str, Any] = {
+    "calib_dir": "data/processed/images",
+    "calib_images": 200,
+    "imgsz": 640,
+    "tolerance": 0.01,
+    "per_channel": True,
+    "models_dir": "models",
+    "out": "reports/quantize.json",
+    "work_dir": "reports/quantize",
+    "holdout_fraction": 0.3,
+    "holdout": {"det": "data/processed"},
+    "tasks": {},
+}
+
+PRIMARY_METRIC = {"det": "map50", "seg": "miou", "cls": "top1"}
+YOLO_TASK = {"det": "detect", "seg": "segment", "cls": "classify"}
+
+
+def _preprocess(img: Image.Image, task: str, imgsz: int) -> np.ndarray:
+    """Match ultralytics inference preprocessing for a fixed-shape export (NCHW float32, 0..1)."""
+    img = img.convert("RGB")
+    w, h = img.size
+    if task == "cls":
+        # classify_transforms: resize short side, center crop
+        r = imgsz / min(w, h)
+        img = img.resize(
+            (max(imgsz, round(w * r)), max(imgsz, round(h * r))), Image.BILINEAR
+        )
+        w, h = img.size
+        left, top = (w - imgsz) // 2, (h - imgsz) // 2
+        img = img.crop((left, top, left + imgsz, top + imgsz))
+        arr = np.asarray(img)
+    else:
+        # letterbox to a square, gray (114) padding, centered
+        r = min(imgsz / w, imgsz / h)
+        nw, nh = round(w * r), round(h * r)
+        arr = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+        top, left = (imgsz - nh) // 2, (imgsz - nw) // 2
+        arr[top : top + nh, left : left + nw] = np.asarray(
+            img.resize((nw, nh), Image.BILINEAR)
+        )
+    return (arr.transpose(2, 0, 1)[None].astype(np.float32)) / 255.0
+
+
+def _images(root: Path) -> Set[Path]:
+    return {f.resolve() for f in root.rglob("*") if f.suffix.lower() in IMG_EXTS}
+
+
+def _holdout_images(task: str, holdout: str) -> Set[Path]:
+    """The images `evaluate_variant` reads for this task (YOLO layout or class folders)."""
+    root = Path(holdout)
+    if task == "cls":
+        return {f for f in _images(root) if f.parent != root.resolve()}
+    return _images(root / "images")
+
+
+def _in_holdout(f: Path, fraction: float) -> bool:
+    h = hashlib.sha1(f.name.encode()).digest()
+    return int.from_bytes(h[:4], "big") < fraction * 2**32
+
+
+def _split(
+    calib_dir: str, holdout: Set[Path], fraction: float
+) -> Tuple[List[Path], Set[Path], int]:
+    """-> (calibration pool, holdout set, shared images split between them); disjoint."""
+    calib = _images(Path(calib_dir))
+    shared = calib & holdout
+    if shared:
+        held = {f for f in shared if _in_holdout(f, fraction)}
+        holdout = (holdout - shared) | held
+        calib = calib - held
+    return sorted(calib), holdout, len(shared)
+
+
+def _calib_files(files: List[Path], calib_dir: str, n: int) -> List[Path]:
+    if not files:
+        raise SystemExit(f"no calibration images under {calib_dir} outside the holdout")
+    step = max(1, len(files) // max(1, n))
+    return files[::step][:n]
+
+
+class _Reader:
+    """onnxruntime CalibrationDataReader over an image folder."""
+
+    def __init__(self, input_name: str, files: List[Path], task: str, imgsz: int):
+        self.input_name = input_name
+        self._it: Iterator[Path] = iter(files)
+        self.task = task
+        self.imgsz = imgsz
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        f = next(self._it, None)
+        if f is None:
+            return None
+        with Image.open(f) as im:
+            return {self.input_name: _preprocess(im, self.task, self.imgsz)}
+
+    def rewind(self) -> None:
+        pass
+
+
+def _head_nodes(onnx_path: Path) -> List[str]:
+    """Non-Conv nodes of the last `/model.N/` module (box decode / DFL / concat), kept in float."""
+    import onnx
+
+    nodes = onnx.load(str(onnx_path)).graph.node
+    idx = [int(m.group(1)) for n in nodes if (m := re.match(r"/model\.(\d+)/", n.name))]
+    if not idx:
+        return []
+    prefix = f"/model.{max(idx)}/"
+    return [n.name for n in nodes if n.name.startswith(prefix) and n.op_type != "Conv"]
+
+
+def _copy_metadata(src: Path, dst: Path) -> None:
+    """Keep ultralytics' metadata (names, stride, imgsz, task) so YOLO() can load the INT8 file."""
+    import onnx
+
+    m_src, m_dst = onnx.load(str(src)), onnx.load(str(dst))
+    have = {p.key for p in m_dst.metadata_props}
+    for p in m_src.metadata_props:
+        if p.key not in have:
+            m_dst.metadata_props.add(key=p.key, value=p.value)
+    onnx.save(m_dst, str(dst))
+
+
+def quantize_task(task: str, weights: str, q: Dict[str, Any]) -> Dict[str, Any]:
+    from onnxruntime import InferenceSession
+    from onnxruntime.quantization import (
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+    from ultralytics import YOLO
+
+    imgsz = int(q["imgsz"])
+    stem = Path(weights).stem
+    models_dir = Path(q["models_dir"])
+    fp32_onnx = Path(
+        YOLO(weights, task=YOLO_TASK[task]).export(
+            format="onnx", imgsz=imgsz, opset=13, simplify=True
+        )
+    )
+    work_dir = Path(q["work_dir"])
+    work_dir.mkdir(parents=True, exist_ok=True)
+    int8_tmp = work_dir / f"{stem}.int8.onnx"
+
+    input_name = (
+        InferenceSession(str(fp32_onnx), providers=["CPUExecutionProvider"])
+        .get_inputs()[0]
+        .name
+    )
+    holdout = (q.get("holdout") or {}).get(task)
+    pool, held, shared = _split(
+        q["calib_dir"],
+        _holdout_images(task, holdout) if holdout else set(),
+        float(q["holdout_fraction"]),
+    )
+    files = _calib_files(pool, q["calib_dir"], int(q["calib_images"]))
+    print(f"[quantize] {task}: calibrating on {len(files)} images")
+    quantize_static(
+        str(fp32_onnx),
+        str(int8_tmp),
+        _Reader(input_name, files, task, imgsz),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=bool(q["per_channel"]),
+        calibrate_method=CalibrationMethod.MinMax,
+        nodes_to_exclude=_head_nodes(fp32_onnx) if task != "cls" else [],
+    )
+    _copy_metadata(fp32_onnx, int8_tmp)
+
+    rec: Dict[str, Any] = {
+        "task": task,
+        "weights": weights,
+        "int8": str(int8_tmp),
+        "calib_images": len(files),
+        "holdout_images": len(held),
+        "shared_images_split": shared,
+        "calib_holdout_overlap": len(held.intersection(files)),
+        "note": "calibration and holdout images must not overlap",
+    }
+    if not holdout:
+        rec.update(
+            published=False,
+            reason="no holdout dataset configured; accuracy guard cannot run",
+        )
+        return rec
+    if not held:
+        rec.update(published=False, reason="no holdout images left after the split")
+        return rec
+
+    metric = PRIMARY_METRIC[task]
+    fp32 = evaluate_variant(
+        {"name": f"{task}-fp32", "task": task, "model_path": weights, "imgsz": imgsz},
+        holdout,
+        3,
+        0,
+        held,
+    )
+    int8 = evaluate_variant(
+        {
+            "name": f"{task}-int8",
+            "task": task,
+            "model_path": str(int8_tmp),
+            "imgsz": imgsz,
+        },
+        holdout,
+        3,
+        0,
+        held,
+    )
+    drop = fp32["metrics"][metric] - int8["metrics"][metric]
+    rec.update(
+        metric=metric,
+        fp32={metric: fp32["metrics"][metric], **fp32["latency"]},
+        int8={metric: int8["metrics"][metric], **int8["latency"]},
+        drop=drop,
+        speedup_p50=fp32["latency"]["p50_ms"] / max(1e-9, int8["latency"]["p50_ms"]),
+        tolerance=float(q["tolerance"]),
+    )
+    if drop > float(q["tolerance"]):
+        rec.update(published=False, reason=f"{metric} drop {drop:.4f} > tolerance")
+        return rec
+
+    store = ArtifactStore.default(models_dir)
+    name = int8_tmp.name
+    sha = store.put(int8_tmp, name)
+    store.materialize(store.object_path(sha), models_dir / name)
+    rec.update(published=True, sha256=sha, path=str(models_dir / name))
+    return rec
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--params", default="params.yaml")
+    ap.add_argument("--tasks", nargs="*", choices=sorted(PRIMARY_METRIC))
+    ap.add_argument("--calib-dir")
+    ap.add_argument("--tolerance", type=float)
+    a = ap.parse_args(argv)
+
+    q = {**DEFAULTS, **((yaml.safe_load(open(a.params)) or {}).get("quantize") or {})}
+    if a.calib_dir:
+        q["calib_dir"] = a.calib_dir
+    if a.tolerance is not None:
+        q["tolerance"] = a.tolerance
+    results = []
+    for task, weights in q["tasks"].items():
+        if a.tasks and task not in a.tasks:
+            continue
+        r = quantize_task(task, weights, q)
+        results.append(r)
+        state = "published" if r["published"] else f"kept fp32 ({r.get('reason')})"
+        print(f"[quantize] {task}: drop={r.get('drop', float('nan')):.4f} -> {state}")
+    out = Path(q["out"])
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Hyperparameter sweep over the `sweep.space` declared in params.yaml.
+
+Trials run concurrently in a process pool; each worker gets an equal share of
+the CPU cores (torch intra-op threads + OMP/MKL env). Budget is allocated by
+successive halving: every trial trains `min_epochs`, the best 1/eta continue
+from their own weights for eta x more epochs, and so on up to `max_epochs`.
+For each trial/rung we record mAP50 and CPU inference latency. The report's
+(mAP50 up, latency down) Pareto front and best trial only compare trials at the
+same budget: `pareto` covers the trials that reached the last rung, and
+`pareto_by_rung` has one front per rung (each entry carries its `epochs`), so a
+config eliminated after `min_epochs` is never ranked against fully trained ones.
+
+  python -m src.training.sweep                 # offline; results in runs/sweep/sweep.json
+  python -m src.training.sweep --wandb         # also log every trial to W&B
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+DEFAULTS: Dict[str, Any] = {
+    "space": {},
+    "max_trials": 0,  # 0 = full grid
+    "parallel": 0,  # 0 = min(trials, cores // 2)
+    "min_epochs": 1,
+    "max_epochs": 9,
+    "eta": 3,
+    "patience": 0,  # ultralytics early stopping inside a rung; 0 = off
+    "latency_images": 20,
+    "out": "runs/sweep",
+    "wandb": False,
+}
+
+
+def expand_space(space: Dict[str, Any], max_trials: int, seed: int) -> List[Dict[str, Any]]:
+    """Cartesian product of list-valued keys; scalars are fixed. Randomly subsampled to max_trials."""
+    keys = sorted(space)
+    values = [v if isinstance(v, list) else [v] for v in (space[k] for k in keys)]
+    grid = [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+    if max_trials and len(grid) > max_trials:
+        grid = random.Random(seed).sample(grid, max_trials)
+    return grid
+
+
+def pareto_front(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Trials not dominated on (higher map50, lower latency_ms)."""
+    front = []
+    for a in results:
+        dominated = any(
+            b["map50"] >= a["map50"]
+            and b["latency_ms"] <= a["latency_ms"]
+            and (b["map50"] > a["map50"] or b["latency_ms"] < a["latency_ms"])
+            for b in results
+        )
+        if not dominated:
+            front.append(a)
+    return sorted(front, key=lambda r: r["latency_ms"])
+
+
+def fronts(history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Best trial and Pareto fronts, compared only within a rung (same epoch budget)."""
+    by_rung: Dict[int, List[Dict[str, Any]]] = {}
+    for r in history:
+        if r.get("weights"):
+            by_rung.setdefault(r["rung"], []).append(r)
+    last = by_rung[max(by_rung)] if by_rung else []
+    return {
+        "best": max(last, key=lambda r: r["map50"], default=None),
+        "pareto": pareto_front(last),
+        "pareto_by_rung": [
+            {"rung": k, "epochs": v[0]["epochs"], "front": pareto_front(v)}
+            for k, v in sorted(by_rung.items())
+        ],
+    }
+
+
+def _init_worker(threads: int) -> None:
+    # must run before torch is imported in the worker
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+
+def _latency_ms(weights: Path, imgsz: int, n: int) -> float:
+    from ultralytics import YOLO
+
+    from .train import DATA_ROOT
+
+    imgs = sorted((DATA_ROOT / "images").rglob("*.jpg"))[: max(1, n)]
+    if not imgs:
+        return float("nan")
+    m = YOLO(str(weights))
+    m.predict(str(imgs[0]), imgsz=imgsz, device="cpu", verbose=False)  # warmup
+    times = []
+    for f in imgs:
+        t0 = time.perf_counter()
+        m.predict(str(f), imgsz=imgsz, device="cpu", verbose=False)
+        times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def run_trial(job: Dict[str, Any]) -> Dict[str, Any]:
+    from .train import fit
+
+    p, tid, rung = job["params"], job["trial"], job["rung"]
+    t0 = time.perf_counter()
+    rec: Dict[str, Any] = {"trial": tid, "rung": rung, "params": job["config"], "epochs": job["total_epochs"]}
+    try:
+        _, best, map50 = fit(
+            p,
+            model=job.get("resume_from"),
+            epochs=job["epochs"],
+            device="cpu",
+            workers=0,  # the process pool already owns the cores
+            patience=job["patience"] or 100,
+            project=job["project"],
+            name=f"t{tid:03d}_r{rung}",
+            exist_ok=True,
+            plots=False,
+        )
+        rec.update(
+            map50=map50,
+            weights=str(best),
+            latency_ms=_latency_ms(best, int(p["imgsz"]), job["latency_images"]),
+        )
+    except Exception as e:  # a broken config must not take the sweep down
+        rec.update(map50=0.0, weights=None, latency_ms=float("inf"), error=str(e))
+    rec["wall_s"] = time.perf_counter() - t0
+    if job["wandb"]:
+        _log_wandb(rec, job["project"])
+    return rec
+
+
+def _log_wandb(rec: Dict[str, Any], group: str) -> None:
+    try:
+        import wandb
+    except ImportError:
+        return
+    run = wandb.init(
+        project=os.getenv("WANDB_PROJECT", "ppe-mlops"),
+        entity=os.getenv("WANDB_ENTITY"),
+        config=rec["params"],
+        group=Path(group).name,
+        name=f"trial-{rec['trial']}-rung-{rec['rung']}",
+        job_type="sweep",
+        reinit=True,
+    )
+    run.log({k: rec[k] for k in ("map50", "latency_ms", "epochs", "wall_s")})
+    run.finish()
+
+
+def sweep(train_p: Dict[str, Any], s: Dict[str, Any]) -> Dict[str, Any]:
+    configs = expand_space(s["space"], int(s["max_trials"]), int(train_p.get("seed", 0)))
+    if not configs:
+        raise SystemExit("params.yaml: sweep.space is empty")
+    cores = os.cpu_count() or 1
+    parallel = int(s["parallel"]) or max(1, min(len(configs), cores // 2))
+    threads = max(1, cores // parallel)
+    eta, budget, max_epochs = int(s["eta"]), int(s["min_epochs"]), int(s["max_epochs"])
+    out = Path(s["out"]).resolve()
+    out.mkdir(parents=True, exist_ok=True)
+
+    alive = {i: {"config": c, "spent": 0, "weights": None} for i, c in enumerate(configs)}
+    history: List[Dict[str, Any]] = []
+    rung = 0
+    print(f"[sweep] {len(configs)} trials, {parallel} parallel x {threads} threads")
+    with ProcessPoolExecutor(
+        parallel,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads,),
+    ) as pool:
+        while alive:
+            budget = min(budget, max_epochs)
+            jobs = []
+            for tid, t in alive.items():
+                jobs.append(
+                    {
+                        "trial": tid,
+                        "rung": rung,
+                        "config": t["config"],
+                        "params": {**train_p, **t["config"]},
+                        "resume_from": t["weights"],
+                        "epochs": budget - t["spent"],
+                        "total_epochs": budget,
+                        "patience": int(s["patience"]),
+                        "latency_images": int(s["latency_images"]),
+                        "project": str(out),
+                        "wandb": bool(s["wandb"]),
+                    }
+                )
+            results = [f.result() for f in as_completed(pool.submit(run_trial, j) for j in jobs)]
+            history.extend(results)
+            for r in sorted(results, key=lambda r: r["trial"]):
+                print(
+                    f"[sweep] rung {rung} trial {r['trial']}: map50={r['map50']:.4f} "
+                    f"latency={r['latency_ms']:.1f}ms epochs={r['epochs']}"
+                )
+            if budget >= max_epochs:
+                break
+            keep = max(1, len(results) // eta)
+            survivors = sorted(
+                (r for r in results if r.get("weights")), key=lambda r: r["map50"], reverse=True
+            )[:keep]
+            alive = {
+                r["trial"]: {"config": r["params"], "spent": budget, "weights": r["weights"]}
+                for r in survivors
+            }
+            budget *= eta
+            rung += 1
+
+    report = {"trials": history, **fronts(history)}
+    (out / "sweep.json").write_text(json.dumps(report, indent=2))
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--params", default="params.yaml")
+    ap.add_argument("--parallel", type=int)
+    ap.add_argument("--wandb", action="store_true", default=None)
+    a = ap.parse_args(argv)
+
+    cfg = yaml.safe_load(open(a.params))
+    s = {**DEFAULTS, **(cfg.get("sweep") or {})}
+    if a.parallel is not None:
+        s["parallel"] = a.parallel
+    if a.wandb is not None:
+        s["wandb"] = a.wandb
+    report = sweep(cfg["train"], s)
+    print("[sweep] pareto front (trials that reached the last rung):")
+    for r in report["pareto"]:
+        print(
+            f"  trial {r['trial']}: map50={r['map50']:.4f} latency={r['latency_ms']:.1f}ms "
+            f"epochs={r['epochs']} {r['params']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,133 @@
+import argparse
 import json
 import os
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-import wandb
 import yaml
-from ultralytics import YOLO
-
-p = yaml.safe_load(open("params.yaml"))["train"]
-out = Path("models/weights.pt")
-out.parent.mkdir(parents=True, exist_ok=True)
-run = wandb.init(
-    project=os.getenv("WANDB_PROJECT", "ppe-mlops"),
-    entity=os.getenv("WANDB_ENTITY"),
-    config=p,
-    job_type="train",
-)
-try:
-    m = YOLO(p.get("model", "yolov8n.pt"))
+
+from .mmap_cache import cached_trainer_cls, load_index
+
+if TYPE_CHECKING:  # ultralytics pulls in torch: import lazily (ddp ranks re-import this module)
+    from ultralytics import YOLO
+
+DATA_ROOT = Path("data/processed")
+
+
+def fit(
+    p: Dict[str, Any],
+    model: Optional[str] = None,
+    epochs: Optional[int] = None,
+    **overrides: Any,
+) -> Tuple["YOLO", Path, float]:
+    """Train one configuration; returns (model, best-weights path, mAP50)."""
+    from ultralytics import YOLO
+
+    # serve images from the prepare_data mmap cache when it was built for this imgsz
+    index = load_index(DATA_ROOT)
+    trainer = (
+        cached_trainer_cls(DATA_ROOT)
+        if index and int(index["imgsz"]) == int(p["imgsz"])
+        else None
+    )
+    m = YOLO(model or p.get("model", "yolov8n.pt"))
     m.train(
-        data="data/processed/data.yaml",
-        epochs=int(p["epochs"]),
+        trainer=trainer,
+        data=str(DATA_ROOT / "data.yaml"),
+        epochs=int(epochs or p["epochs"]),
         imgsz=int(p["imgsz"]),
         batch=int(p["batch"]),
         lr0=float(p["lr0"]),
         seed=int(p["seed"]),
         verbose=False,
+        **overrides,
     )
-    m.export(format="pt", imgsz=int(p["imgsz"]), opset=12)
     best = Path(getattr(m.trainer, "best", "models/weights.pt"))
+    box = getattr(getattr(m, "metrics", None), "box", None)
+    return m, best, float(box.map50) if box else 0.0
+
+
+def _wandb_run(p: Dict[str, Any]):
+    # W&B is optional: skip it when not installed or WANDB_MODE=disabled
+    if os.getenv("WANDB_MODE") == "disabled":
+        return None
+    try:
+        import wandb
+    except ImportError:
+        return None
+    return wandb.init(
+        project=os.getenv("WANDB_PROJECT", "ppe-mlops"),
+        entity=os.getenv("WANDB_ENTITY"),
+        config=p,
+        job_type="train",
+    )
+
+
+def publish(
+    best: Path,
+    map50: float,
+    run: Any = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Write models/weights.pt + metrics.json and log the model artifact (rank 0 only under DDP)."""
+    out = Path("models/weights.pt")
+    out.parent.mkdir(parents=True, exist_ok=True)
     (
         out.write_bytes(best.read_bytes())
         if best.exists()
         else out.write_text("DUMMY WEIGHTS")
     )
-    metrics = {
-        "map50": (
-            float(getattr(getattr(m, "metrics", object()), "box", object()).map50)
-            if getattr(getattr(m, "metrics", None), "box", None)
-            else 0.0
-        )
-    }
-except Exception as e:
-    print("train fail:", e)
-    metrics = {"map50": 0.0}
-    out.write_text("DUMMY WEIGHTS")
-json.dump(metrics, open("metrics.json", "w"))
-A = wandb.Artifact("model", type="model")
-A.add_file(str(out), "weights.pt")
-run.log_artifact(A)
-run.finish()
-print("done")
+    json.dump({"map50": map50, **(extra or {})}, open("metrics.json", "w"))
+    if run is not None:
+        import wandb
+
+        A = wandb.Artifact("model", type="model")
+        A.add_file(str(out), "weights.pt")
+        run.log_artifact(A)
+        run.finish()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Train the detector (params.yaml: train).")
+    ap.add_argument("--procs", type=int, help="data-parallel CPU processes (gloo)")
+    ap.add_argument(
+        "--scaling",
+        help="comma-separated process counts: report epoch time / scaling efficiency only",
+    )
+    ap.add_argument("--scaling-epochs", type=int, default=2)
+    a = ap.parse_args(argv)
+
+    p = yaml.safe_load(open("params.yaml"))["train"]
+    if a.scaling:
+        from .ddp import scaling
+
+        report = scaling(p, [int(n) for n in a.scaling.split(",")], a.scaling_epochs)
+        Path("reports").mkdir(exist_ok=True)
+        Path("reports/train_scaling.json").write_text(json.dumps(report, indent=2))
+        return
+
+    procs = int(a.procs or p.get("procs", 1))
+    if procs > 1:
+        from .ddp import fit_ddp
+
+        try:
+            fit_ddp(p, procs)  # rank 0 publishes
+        except Exception as e:
+            print("train fail:", e)
+            publish(Path("models/weights.pt.missing"), 0.0)
+        print("done")
+        return
+
+    run = _wandb_run(p)
+    try:
+        m, best, map50 = fit(p)
+        m.export(format="pt", imgsz=int(p["imgsz"]), opset=12)
+    except Exception as e:
+        print("train fail:", e)
+        best, map50 = Path("models/weights.pt.missing"), 0.0
+    publish(best, map50, run)
+    print("done")
+
+
+if __name__ == "__main__":
+    main()
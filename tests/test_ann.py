@@ -0,0 +1,24 @@
+"""IVFIndex persistence: keys stay row-aligned across a reopen."""
+
+from __future__ import annotations
+
+import numpy as np
+
+from src.serving.ann import IVFIndex
+
+
+def test_keys_with_line_breaks_survive_reopen(tmp_path):
+    idx = IVFIndex(tmp_path, dim=8, nlist=4)
+    keys = ["a\nb", "c d", "e\r", "f"]
+    idx.add(np.eye(8)[:4], keys)
+    reopened = IVFIndex(tmp_path)
+    assert reopened.keys == keys
+    assert reopened.search(np.eye(8)[3], k=1)[0][0][0] == "f"
+
+
+def test_legacy_keys_txt_is_converted(tmp_path):
+    IVFIndex(tmp_path, dim=8, nlist=4).add(np.eye(8)[:3], ["p", "q", "r"])
+    (tmp_path / "keys.jsonl").unlink()
+    (tmp_path / "keys.txt").write_text("p\nq\nr\n")
+    assert IVFIndex(tmp_path).keys == ["p", "q", "r"]
+    assert (tmp_path / "keys.jsonl").exists()
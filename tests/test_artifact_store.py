@@ -0,0 +1,134 @@
+"""ArtifactStore downloads against a local HTTP server: resume, 416, truncation."""
+
+from __future__ import annotations
+
+import hashlib
+import http.server
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+from src.artifacts.store import ArtifactStore
+
+BLOB = os.urandom(1_024_000)
+SHA = hashlib.sha256(BLOB).hexdigest()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # per-test knobs, set on the class by the fixture
+    truncate_first: int = 0  # close after this many body bytes on the first N requests
+    truncations: int = 0
+    honour_range: bool = True
+    requests: list = []
+
+    def log_message(self, *args):  # keep pytest output clean
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        rng = self.headers.get("Range")
+        cls.requests.append(rng)
+        start = 0
+        if rng and cls.honour_range:
+            start = int(rng.split("=")[1].split("-")[0])
+            if start >= len(BLOB):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(BLOB)}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(BLOB) - 1}/{len(BLOB)}"
+            )
+        else:
+            self.send_response(200)
+        body = BLOB[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if cls.truncations > 0:
+            cls.truncations -= 1
+            self.wfile.write(body[: cls.truncate_first])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    handler = type("H", (_Handler,), {"requests": []})
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    t = threading.Thread(target=httpd.serve_forever, daemon=True)
+    t.start()
+    yield handler, f"http://127.0.0.1:{httpd.server_address[1]}/w.pt"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _store(tmp_path: Path) -> ArtifactStore:
+    return ArtifactStore(tmp_path / "store", timeout=5, retries=3)
+
+
+def test_full_download_pins_hash(tmp_path, server):
+    _, url = server
+    store = _store(tmp_path)
+    obj = store.fetch("w.pt", url)
+    assert obj.read_bytes() == BLOB
+    assert store.manifest()["w.pt"]["sha256"] == SHA
+
+
+def test_truncated_body_is_resumed_not_accepted(tmp_path, server):
+    handler, url = server
+    handler.truncate_first, handler.truncations = 512_000, 1
+    store = _store(tmp_path)
+    obj = store.fetch("w.pt", url)
+    assert obj.stat().st_size == len(BLOB)
+    assert store.manifest()["w.pt"]["sha256"] == SHA
+    assert handler.requests == [None, "bytes=512000-"]
+
+
+def test_truncation_without_range_support_restarts(tmp_path, server):
+    handler, url = server
+    handler.honour_range = False
+    handler.truncate_first, handler.truncations = 512_000, 1
+    obj = _store(tmp_path).fetch("w.pt", url)
+    assert obj.read_bytes() == BLOB
+
+
+def test_persistent_truncation_fails_and_pins_nothing(tmp_path, server, monkeypatch):
+    monkeypatch.setattr("src.artifacts.store.time.sleep", lambda s: None)
+    handler, url = server
+    handler.truncate_first, handler.truncations = 0, 100
+    store = _store(tmp_path)
+    with pytest.raises(RuntimeError):
+        store.fetch("w.pt", url)
+    assert "w.pt" not in store.manifest()
+
+
+def test_resume_existing_partial(tmp_path, server):
+    handler, url = server
+    store = _store(tmp_path)
+    (store.tmp / "w.pt.partial").write_bytes(BLOB[:300_000])
+    obj = store.fetch("w.pt", url)
+    assert obj.read_bytes() == BLOB
+    assert handler.requests == ["bytes=300000-"]
+
+
+def test_416_with_complete_partial_is_ingested(tmp_path, server):
+    handler, url = server
+    store = _store(tmp_path)
+    (store.tmp / "w.pt.partial").write_bytes(BLOB)
+    obj = store.fetch("w.pt", url, sha256=SHA)
+    assert obj.read_bytes() == BLOB
+    assert handler.requests == [f"bytes={len(BLOB)}-"]
+
+
+def test_416_with_oversized_partial_restarts(tmp_path, server):
+    handler, url = server
+    store = _store(tmp_path)
+    (store.tmp / "w.pt.partial").write_bytes(BLOB + b"junk")
+    obj = store.fetch("w.pt", url)
+    assert obj.read_bytes() == BLOB
+    assert store.manifest()["w.pt"]["sha256"] == SHA
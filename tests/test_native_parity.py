@@ -0,0 +1,57 @@
+"""INFERENCE_BACKEND=native matches the ultralytics predictor (det, seg) on synthetic images."""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("ultralytics")
+
+from src.serving.inference import build_service  # noqa: E402
+from src.training.prepare_data import GENERATOR_VERSION, _render_synthetic  # noqa: E402
+
+WEIGHTS = {
+    "det": os.getenv("DET_MODEL_PATH", "models/yolov8n.pt"),
+    "seg": os.getenv("SEG_MODEL_PATH", "models/yolov8n-seg.pt"),
+}
+SIZES = [(640, 480), (500, 375), (320, 640)]  # exercise letterbox padding on both axes
+ATOL_PX, CONF_ATOL = 1.0, 1e-3
+
+
+def _images():
+    specs = [
+        {"v": GENERATOR_VERSION, "seed": 7, "i": i, "w": w, "h": h}
+        for i, (w, h) in enumerate(SIZES)
+    ]
+    return [_render_synthetic(spec)[0] for spec in specs]
+
+
+def _coords(task, inst):
+    if task == "det":
+        return np.array([inst[k] for k in ("x1", "y1", "x2", "y2")])
+    return np.array(inst["points"])
+
+
+@pytest.mark.parametrize("task", ["det", "seg"])
+def test_native_matches_ultralytics(task):
+    weights = WEIGHTS[task]
+    if not Path(weights).exists():
+        pytest.skip(f"{weights} not available")
+    ref = build_service(task, native=False, model_path=weights)
+    lean = build_service(task, native=True, model_path=weights)
+    if getattr(lean, "lean", None) is None:
+        pytest.skip("native path needs PyTorch weights")
+    key = "bboxes" if task == "det" else "masks"
+    for img in _images():
+        a, b = ref.predict(img)[key], lean.predict(img)[key]
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert x["cls"] == y["cls"]
+            assert abs(x["conf"] - y["conf"]) <= CONF_ATOL
+            p, q = _coords(task, x), _coords(task, y)
+            assert p.shape == q.shape
+            if p.size:
+                assert np.abs(p - q).max() <= ATOL_PX
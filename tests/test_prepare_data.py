@@ -0,0 +1,58 @@
+"""prepare_data + mmap cache: rebuilt items never serve stale cached pixels."""
+
+from __future__ import annotations
+
+import numpy as np
+from PIL import Image
+
+from src.training import mmap_cache
+from src.training import prepare_data as pd
+
+
+def _params(out, **kw):
+    return {**pd.DEFAULTS, "out": str(out), "num_images": 4, "workers": 1, **kw}
+
+
+def _cached_matches_disk(root) -> None:
+    m = mmap_cache.MmapImages(root)
+    assert m.items
+    for rel in m.items:
+        hit = m.get(str(root / rel))
+        assert hit is not None
+        h, w = hit[2]
+        im = Image.open(root / rel).convert("RGB")
+        if im.size != (w, h):
+            im = im.resize((w, h), Image.BILINEAR)
+        on_disk = np.asarray(im, dtype=np.int16)
+        assert np.abs(hit[0][..., ::-1].astype(np.int16) - on_disk).mean() < 1.0
+
+
+def test_rebuild_without_cache_flag_refreshes_existing_cache(tmp_path):
+    pd.build(_params(tmp_path, cache=True, cache_imgsz=640))
+    stats = pd.build(_params(tmp_path, cache=False, seed=7))
+    assert stats["built"] == 4 and stats["cached"] == 4
+    _cached_matches_disk(tmp_path)
+
+
+def test_row_with_stale_key_is_a_miss(tmp_path):
+    pd.build(_params(tmp_path, cache=True, cache_imgsz=640))
+    m = mmap_cache.MmapImages(tmp_path)
+    rel = sorted(m.items)[0]
+    m.keys[rel] = "changed"
+    assert m.get(str(tmp_path / rel)) is None
+
+
+def test_new_source_file_keeps_ids_and_appends_a_row(tmp_path):
+    src, out = tmp_path / "src", tmp_path / "out"
+    src.mkdir()
+    for i in (0, 2, 4):
+        Image.new("RGB", (64, 48), (40 * i, 0, 0)).save(src / f"f{i}.jpg")
+    p = _params(out, source=str(src), cache=True, cache_imgsz=32)
+    pd.build(p)
+    before = mmap_cache.load_index(out)["items"]
+    Image.new("RGB", (64, 48), (0, 255, 0)).save(src / "f1.jpg")
+    stats = pd.build(p)
+    after = mmap_cache.load_index(out)["items"]
+    assert stats["built"] == 1 and stats["cached"] == 1
+    assert all(after[r] == meta for r, meta in before.items())
+    _cached_matches_disk(out)
@@ -0,0 +1,45 @@
+"""Profiler sessions: closing waits for in-flight calls and ignores late ones."""
+
+from __future__ import annotations
+
+import io
+import json
+import threading
+import time
+import zipfile
+
+from src.serving.profiling import Profiler, ProfileSession
+
+
+def test_close_waits_for_inflight_call_and_later_calls_run_unprofiled():
+    prof = Profiler()
+    session = ProfileSession(
+        max_calls=100, seconds=0.2, torch_profile=False, memory=False
+    )
+    entered, release = threading.Event(), threading.Event()
+
+    def slow():
+        entered.set()
+        release.wait(5)
+        return "slow"
+
+    out = {}
+    t = threading.Thread(target=lambda: out.setdefault("r", prof.call(slow)))
+    blob = {}
+    p = threading.Thread(target=lambda: blob.setdefault("zip", prof.profile(session)))
+    p.start()
+    while prof.session is None:
+        time.sleep(0.001)
+    t.start()
+    entered.wait(5)
+    time.sleep(0.3)  # session window is over; profile() is blocked in close()
+    assert p.is_alive()
+    release.set()
+    p.join(5)
+    t.join(5)
+    assert out["r"] == "slow"
+    summary = json.loads(zipfile.ZipFile(io.BytesIO(blob["zip"])).read("summary.json"))
+    assert summary["calls"] == 1
+    # the session is closed: a call that still holds it is not recorded
+    assert session.run(lambda: 42) == 42
+    assert session.calls == 1
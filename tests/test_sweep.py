@@ -0,0 +1,41 @@
+"""Sweep report: fronts only compare trials trained for the same budget."""
+
+from __future__ import annotations
+
+from src.training.sweep import fronts
+
+
+def _rec(trial, rung, epochs, map50, latency_ms):
+    return {
+        "trial": trial,
+        "rung": rung,
+        "epochs": epochs,
+        "map50": map50,
+        "latency_ms": latency_ms,
+        "weights": f"t{trial}_r{rung}.pt",
+        "params": {},
+    }
+
+
+def test_eliminated_fast_trial_is_not_on_the_final_front():
+    history = [
+        _rec(0, 0, 1, 0.10, 5.0),  # fast, weak: eliminated at rung 0
+        _rec(1, 0, 1, 0.30, 20.0),
+        _rec(2, 0, 1, 0.25, 30.0),
+        _rec(1, 1, 3, 0.50, 20.0),
+    ]
+    report = fronts(history)
+    assert [r["trial"] for r in report["pareto"]] == [1]
+    assert report["best"]["trial"] == 1 and report["best"]["epochs"] == 3
+    rung0 = report["pareto_by_rung"][0]
+    assert rung0["epochs"] == 1
+    assert [r["trial"] for r in rung0["front"]] == [0, 1]
+
+
+def test_failed_trials_are_ignored():
+    history = [
+        _rec(0, 0, 1, 0.2, 10.0),
+        {**_rec(1, 0, 1, 0.0, float("inf")), "weights": None},
+    ]
+    assert [r["trial"] for r in fronts(history)["pareto"]] == [0]
+    assert fronts([])["best"] is None